@@ -6,55 +6,797 @@ This is a simplified demonstration that shows how MCP works conceptually
 without requiring an actual MCP server to be running. Perfect for learning!
 """
 
+import heapq
 import json
-from typing import Any
+import sqlite3
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Collection, Iterable, Iterator
+
+from task_data import (
+    FORMATS,
+    NextTaskScan,
+    PRIORITIES,
+    SQLITE_SCHEMA,
+    SQLITE_STATEMENTS,
+    TaskTable,
+    Transaction,
+    apply_record,
+    chunked,
+    count_stats,
+    decode_cursor,
+    decode_tasks,
+    detect_format,
+    document_meta,
+    encode_cursor,
+    encode_document,
+    iter_decode_tasks,
+    matches_status,
+    read_meta,
+    record_task_id,
+    split_document,
+    stats_counts,
+)
+
+
+def copy_value(value: Any) -> Any:
+    """Copy nested lists and dicts; every other JSON value is immutable."""
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: copy_value(item) if isinstance(item, (list, dict)) else item
+            for key, item in value.items()
+        }
+    return value
+
+
+def stored_tasks(value: Any) -> list[dict[str, Any]]:
+    """Return the task list of a document stored as an object.
+    
+    Documents saved with metadata are stored as {"meta": ..., "tasks": [...]},
+    others as the bare list.
+    """
+    return value["tasks"] if isinstance(value, dict) else value
 
 
 class SimulatedMCPServer:
-    """Simulates an MCP filesystem server for demonstration purposes."""
+    """Simulates an MCP filesystem server for demonstration purposes.
     
-    def __init__(self):
+    With store_objects enabled, write_file also accepts a structured
+    "value" and read_file/read_multiple_files return it when called with
+    "as_object". The server then keeps the Python object itself and only
+    serializes it if someone asks for the file as text, so in-process
+    clients skip JSON encoding and decoding. Values are copied on the way in
+    and out, just as text would be; "key" reads one entry of a stored dict.
+    
+    read_file takes "tail" to return only the last lines of a text file,
+    and patch_file takes a list of "patches" applied in one step.
+    """
+    
+    def __init__(self, store_objects: bool = False):
         self.filesystem = {}  # In-memory file system
+        self.objects = {}  # Structured values stored without serializing
+        self.store_objects = store_objects
         self.tools = {
             "read_file": "Read contents of a file",
             "write_file": "Write contents to a file",
-            "list_directory": "List files in a directory"
+            "append_file": "Append contents to the end of a file",
+            "patch_file": "Replace a byte range of a file",
+            "list_directory": "List files in a directory",
+            "read_multiple_files": "Read several files in one call"
         }
+        self.bytes_moved = 0  # Total file content bytes sent and received
     
     def list_tools(self):
         """List available tools."""
         return self.tools
     
     def call_tool(self, tool_name: str, arguments: dict) -> dict:
+        """Execute a tool and report the file content bytes it moved."""
+        result = self._execute(tool_name, arguments)
+        moved = self._payload_bytes(arguments) + self._payload_bytes(result)
+        self.bytes_moved += moved
+        result["bytes"] = moved
+        return result
+    
+    def _execute(self, tool_name: str, arguments: dict) -> dict:
         """Execute a tool with given arguments."""
         if tool_name == "read_file":
             path = arguments["path"]
-            if path in self.filesystem:
-                return {"content": self.filesystem[path]}
+            if arguments.get("as_object") and path in self.objects:
+                value = self.objects[path]
+                if "key" in arguments:
+                    value = value.get(arguments["key"]) if isinstance(value, dict) else None
+                return {"value": copy_value(value)}
+            content = self._text(path)
+            if content is not None:
+                if arguments.get("tail"):
+                    content = "".join(content.splitlines(keepends=True)[-arguments["tail"]:])
+                return {"content": content}
             else:
                 return {"content": "[]"}  # Empty file
         
         elif tool_name == "write_file":
             path = arguments["path"]
+            if "value" in arguments and self.store_objects:
+                self.objects[path] = copy_value(arguments["value"])
+                self.filesystem.pop(path, None)
+                return {"success": True}
             content = arguments["content"]
             self.filesystem[path] = content
+            self.objects.pop(path, None)
+            return {"success": True}
+        
+        elif tool_name == "append_file":
+            path = arguments["path"]
+            if self._text(path) is None:
+                return {"error": f"File not found: {path}"}
+            self.filesystem[path] += arguments["content"]
+            self.objects.pop(path, None)
+            return {"success": True}
+        
+        elif tool_name == "patch_file":
+            # Replace `length` bytes starting at byte `offset` with `content`,
+            # for one range or a list of "patches" that don't overlap
+            path = arguments["path"]
+            content = self._text(path)
+            if content is None:
+                return {"error": f"File not found: {path}"}
+            data = content.encode()
+            patches = arguments.get("patches") or [arguments]
+            for patch in patches:
+                offset, length = patch["offset"], patch["length"]
+                if offset < 0 or length < 0 or offset + length > len(data):
+                    return {"error": f"Byte range out of bounds: {path}"}
+            # Offsets refer to the file before patching, so work from the end
+            for patch in sorted(patches, key=lambda patch: patch["offset"], reverse=True):
+                offset, length = patch["offset"], patch["length"]
+                data = data[:offset] + patch["content"].encode() + data[offset + length:]
+            self.filesystem[path] = data.decode()
+            self.objects.pop(path, None)
             return {"success": True}
         
         elif tool_name == "list_directory":
-            return {"files": list(self.filesystem.keys())}
+            return {"files": list(self.filesystem.keys() | self.objects.keys())}
+        
+        elif tool_name == "read_multiple_files":
+            paths = arguments["paths"]
+            if arguments.get("as_object"):
+                # Stored objects come back as values, text files as strings
+                return {
+                    "values": [
+                        copy_value(self.objects[path]) if path in self.objects
+                        else self._text(path) or "[]"
+                        for path in paths
+                    ]
+                }
+            return {"contents": [self._text(path) or "[]" for path in paths]}
         
         else:
             return {"error": f"Unknown tool: {tool_name}"}
+    
+    def _text(self, path: str) -> str | None:
+        """Return a file as text, serializing a stored object on first use."""
+        if path not in self.filesystem and path in self.objects:
+            value = self.objects[path]
+            if isinstance(value, dict):
+                # Read back as the text a document with metadata is saved as
+                tasks = TaskTable(value["tasks"], value["meta"]["next_id"])
+                self.filesystem[path] = encode_document(tasks, metadata=True)
+            else:
+                self.filesystem[path] = json.dumps(value, indent=2)
+        return self.filesystem.get(path)
+    
+    @staticmethod
+    def _payload_bytes(message: dict) -> int:
+        """Count the bytes of text content carried by a request or response."""
+        total = 0
+        for patch in message.get("patches", ()):
+            total += len(patch["content"].encode())
+        for key in ("content", "contents", "values"):
+            value = message.get(key)
+            if isinstance(value, str):
+                total += len(value.encode())
+            elif isinstance(value, list):
+                total += sum(len(item.encode()) for item in value if isinstance(item, str))
+        return total
+
+
+class SimulatedSQLiteServer:
+    """Simulates an MCP SQLite server backed by an in-memory database."""
+    
+    def __init__(self, database: str = ":memory:"):
+        self.connection = sqlite3.connect(database)
+        self.connection.row_factory = sqlite3.Row
+        self.tools = {
+            "read_query": "Run a SELECT query",
+            "write_query": "Run INSERT, UPDATE or DELETE queries in one transaction",
+            "create_table": "Create a table"
+        }
+    
+    def list_tools(self):
+        """List available tools."""
+        return self.tools
+    
+    def call_tool(self, tool_name: str, arguments: dict) -> dict:
+        """Execute a tool with given arguments."""
+        if tool_name == "read_query":
+            cursor = self.connection.execute(arguments["query"], arguments.get("params", ()))
+            return {"rows": [dict(row) for row in cursor]}
+        
+        elif tool_name == "write_query":
+            # A batch of {"query", "params"} statements commits atomically
+            statements = arguments.get("batch") or [arguments]
+            with self.connection:
+                for statement in statements:
+                    self.connection.execute(statement["query"], statement.get("params", ()))
+            return {"success": True}
+        
+        elif tool_name == "create_table":
+            self.connection.executescript(arguments["query"])
+            return {"success": True}
+        
+        else:
+            return {"error": f"Unknown tool: {tool_name}"}
+
+
+def text_patch(old: str, new: str) -> tuple[int, int, str]:
+    """Find the smallest single replacement that turns old into new.
+    
+    Returns (start, length, replacement) in characters of old.
+    """
+    limit = min(len(old), len(new))
+    start = 0
+    # Skip equal text in large steps before narrowing down char by char
+    while start + 4096 <= limit and old[start:start + 4096] == new[start:start + 4096]:
+        start += 4096
+    while start < limit and old[start] == new[start]:
+        start += 1
+    
+    end = 0
+    limit -= start
+    while end + 4096 <= limit and old[len(old) - end - 4096:len(old) - end] == new[len(new) - end - 4096:len(new) - end]:
+        end += 4096
+    while end < limit and old[len(old) - end - 1] == new[len(new) - end - 1]:
+        end += 1
+    return start, len(old) - end - start, new[start:len(new) - end]
+
+
+def document_patches(old: str, new: str) -> list[dict[str, Any]]:
+    """Compute patch_file byte ranges that turn one task document into another.
+    
+    The tasks and the metadata trailer are patched separately, so a change
+    in the middle of the tasks doesn't drag the rest of the document along.
+    """
+    patches = []
+    offset = 0
+    for old_part, new_part in zip(split_document(old), split_document(new)):
+        if old_part != new_part:
+            start, length, replacement = text_patch(old_part, new_part)
+            patches.append({
+                "offset": offset + len(old_part[:start].encode()),
+                "length": len(old_part[start:start + length].encode()),
+                "content": replacement
+            })
+        offset += len(old_part.encode())
+    return patches
+
+
+class IdFile:
+    """The next unused task id, kept in a small JSON file on the server.
+    
+    The number only grows, so ids are never handed out twice, even after the
+    task holding the highest one is deleted. A file that does not exist yet
+    starts at first_free(), the id after the highest one already stored.
+    """
+    
+    def __init__(self, mcp_server: SimulatedMCPServer, path: str, first_free):
+        self.mcp_server = mcp_server
+        self.path = path
+        self.first_free = first_free
+    
+    def take(self, count: int) -> int:
+        """Reserve count ids and return the first."""
+        state = json.loads(self.mcp_server.call_tool("read_file", {"path": self.path})["content"])
+        # A missing file reads as an empty list
+        next_id = state["next_id"] if isinstance(state, dict) else self.first_free()
+        self.mcp_server.call_tool(
+            "write_file",
+            {"path": self.path, "content": json.dumps({"next_id": next_id + count})}
+        )
+        return next_id
+
+
+class IdSequence:
+    """Hands out task ids from blocks reserved block ids at a time.
+    
+    take(count) reserves count consecutive ids on the server and returns the
+    first, so only one add_task in block pays for a reservation. Ids left in
+    a block when the program exits are skipped, never reused.
+    """
+    
+    def __init__(self, take, block: int = 100):
+        self.take = take
+        self.block = block
+        # The reserved ids not handed out yet: [_next, _end)
+        self._next = self._end = 0
+    
+    def reserve(self, count: int) -> int:
+        """Reserve count consecutive ids and return the first."""
+        if self._end - self._next < count:
+            size = max(count, self.block)
+            self._next = self.take(size)
+            self._end = self._next + size
+        first_id = self._next
+        self._next += count
+        return first_id
+
+
+class TaskStorage:
+    """Base class for task storage backends."""
+    
+    def scan(self) -> Iterator[dict[str, Any]]:
+        """Yield every task in id order."""
+        yield from self.load()
+    
+    def select(self, priority: str | None = None, completed: bool | None = None) -> Iterator[dict[str, Any]]:
+        """Yield the tasks with the given priority and/or completion status.
+        
+        The tasks are filtered as they stream past; an index would be built
+        for a single query.
+        """
+        for task in self.scan():
+            if matches_status(task, priority, completed):
+                yield task
+    
+    def page(
+        self,
+        after: int,
+        limit: int,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> list[dict[str, Any]]:
+        """Return up to limit matching tasks with ids greater than after.
+        
+        The tasks stream past in id order and parsing stops once the page
+        is full.
+        """
+        matching = (task for task in self.select(priority, completed) if task["id"] > after)
+        return list(islice(matching, limit))
+    
+    def next_tasks(self, k: int) -> list[dict[str, Any]]:
+        """Return the k most urgent open tasks, keeping only the best k while scanning."""
+        scan = NextTaskScan(k)
+        for task in self.scan():
+            scan.add(task)
+        return scan.results()
+    
+    def stats(self) -> dict[str, Any]:
+        """Count tasks by status and priority as they stream past."""
+        counts = Counter((task["priority"], task["completed"]) for task in self.scan())
+        return count_stats((priority, completed, count) for (priority, completed), count in counts.items())
+    
+    def reserve_ids(self, count: int) -> int | None:
+        """Reserve count new task ids and return the first.
+        
+        Returns None when new tasks should take the task table's next_id()
+        as they are saved instead, because the next id is saved with it.
+        """
+        return None
+    
+    def _first_free_id(self) -> int:
+        """Return the id after the highest one stored, to start a sequence."""
+        return self.load().next_id()
+    
+    def _renumber_duplicates(self, tasks: TaskTable) -> list[dict[str, Any]]:
+        """Give tasks that repeat an earlier id fresh ids, reserved like new ones."""
+        if not tasks.duplicates:
+            return []
+        return tasks.renumber_duplicates(self.reserve_ids(len(tasks.duplicates)))
+
+
+class JsonFileStorage(TaskStorage):
+    """Stores the whole task list as one JSON document.
+    
+    format is "array" (a pretty-printed list) or "ndjson" (one task per
+    line); files are read in either format and rewritten in the configured
+    one, which is how array files migrate.
+    
+    The storage remembers the text it last read or wrote, so a change is sent
+    as an append_file (when the document only grew at the end) or a
+    patch_file of the changed bytes.
+    
+    When the server stores objects, the task list is handed over as is and
+    none of the text handling above happens.
+    
+    With metadata enabled the document also carries the task counts and the
+    next id, as a last "#meta" line or a "meta" entry next to the stored
+    list, so stats() can answer without reading any task. Such a file is no
+    longer plain JSON. Without it, ids come from "<path>.ids" id_block at a
+    time, so deleted ids are not handed out again either way.
+    """
+    
+    def __init__(
+        self,
+        mcp_server: SimulatedMCPServer,
+        path: str,
+        format: str = "array",
+        metadata: bool = False,
+        id_block: int = 100
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format: {format}")
+        self.mcp_server = mcp_server
+        self.path = path
+        self.format = format
+        self.metadata = metadata
+        self.ids = IdSequence(IdFile(mcp_server, f"{path}.ids", self._first_free_id).take, id_block)
+        self._content: str | None = None
+    
+    def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Read tasks using MCP server's read_file tool."""
+        result = self.mcp_server.call_tool(
+            "read_file",
+            {"path": self.path, "as_object": self.mcp_server.store_objects}
+        )
+        if "value" in result:
+            self._content = None
+            value = result["value"]
+            if isinstance(value, dict):
+                return TaskTable(value["tasks"], value["meta"].get("next_id", 1))
+            return TaskTable(value)
+        return self.adopt(result.get("content", "[]"))
+    
+    def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Write the new document, with its counts when metadata is on."""
+        self._write_document(tasks)
+    
+    def reserve_ids(self, count: int) -> int | None:
+        """Reserve ids from "<path>.ids", unless the document keeps the next id."""
+        if self.metadata:
+            return None
+        return self.ids.reserve(count)
+    
+    def stats(self) -> dict[str, Any]:
+        """Read the task counts from the document's metadata alone, if it has any."""
+        if not self.metadata:
+            return super().stats()
+        if self.mcp_server.store_objects:
+            result = self.mcp_server.call_tool("read_file", {"path": self.path, "as_object": True, "key": "meta"})
+            meta = result.get("value")
+        else:
+            meta = read_meta(self.mcp_server.call_tool("read_file", {"path": self.path, "tail": 1})["content"])
+        if not isinstance(meta, dict):
+            # Missing (which reads as empty), or written before the counts
+            # were; count the tasks instead
+            return super().stats()
+        return meta["stats"]
+    
+    def _write_document(self, tasks: TaskTable):
+        """Send only the changed bytes, or the whole document if we must."""
+        if self.mcp_server.store_objects:
+            value = {"meta": document_meta(tasks), "tasks": list(tasks)} if self.metadata else list(tasks)
+            self.mcp_server.call_tool("write_file", {"path": self.path, "value": value})
+            self._content = None
+            return
+        
+        content = self.encode(tasks)
+        old = self._content
+        self._content = content
+        if old is not None:
+            if content.startswith(old):
+                result = self.mcp_server.call_tool(
+                    "append_file",
+                    {"path": self.path, "content": content[len(old):]}
+                )
+            else:
+                result = self.mcp_server.call_tool(
+                    "patch_file",
+                    {"path": self.path, "patches": document_patches(old, content)}
+                )
+            if "error" not in result:
+                return
+        
+        # Nothing known about the file yet (or the patch failed): write it all
+        self.mcp_server.call_tool("write_file", {"path": self.path, "content": content})
+    
+    def scan(self) -> Iterator[dict[str, Any]]:
+        """Stream tasks from the document text without building the list."""
+        if self.mcp_server.store_objects:
+            yield from self.load()
+            return
+        
+        result = self.mcp_server.call_tool("read_file", {"path": self.path})
+        self._content = result.get("content", "[]")
+        yield from iter_decode_tasks(self._content)
+    
+    def migrate(self) -> bool:
+        """Rewrite the file if it is in another format or has tasks sharing an id.
+        
+        Those tasks get fresh ids; returns whether anything was rewritten.
+        """
+        tasks = self.load()
+        renumbered = self._renumber_duplicates(tasks)
+        reformat = detect_format(self._content or "") not in (None, self.format)
+        if not (renumbered or reformat):
+            return False
+        if reformat:
+            self._content = None
+        self.save(tasks, [])
+        return True
+    
+    def adopt(self, content: str) -> TaskTable:
+        """Parse text read from the server and remember it for patching."""
+        self._content = content
+        return self.decode(content)
+    
+    def decode(self, content: str) -> TaskTable:
+        """Parse the document text into a task list."""
+        meta = read_meta(content) or {}
+        return TaskTable(decode_tasks(content), meta.get("next_id", 1))
+    
+    def encode(self, tasks: TaskTable) -> str:
+        """Render a task list as document text."""
+        return encode_document(tasks, self.format, self.metadata)
+
+
+class ShardedStorage(TaskStorage):
+    """Spreads tasks over several JSON documents keyed by a hash of the id.
+    
+    Completing or deleting a task only reads and rewrites the shard that
+    holds it; listing reads every shard with one read_multiple_files call.
+    """
+    
+    def __init__(
+        self,
+        mcp_server: SimulatedMCPServer,
+        path: str,
+        shards: int = 8,
+        id_block: int = 100,
+        **shard_options
+    ):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.mcp_server = mcp_server
+        self.ids = IdSequence(IdFile(mcp_server, f"{path}.ids", self._first_free_id).take, id_block)
+        stem = path.removesuffix(".json")
+        self.shards = [
+            JsonFileStorage(mcp_server, f"{stem}.shard-{index:02d}.json", **shard_options)
+            for index in range(shards)
+        ]
+    
+    def shard_index(self, task_id: int) -> int:
+        """Return the index of the shard that owns task_id."""
+        return zlib.crc32(str(task_id).encode()) % len(self.shards)
+    
+    def reserve_ids(self, count: int) -> int:
+        """Reserve ids from "<path>.ids", id_block at a time.
+        
+        Each shard only sees its own tasks, so the next id is kept apart.
+        """
+        return self.ids.reserve(count)
+    
+    def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Read only the shards holding task_ids when given, otherwise all of them."""
+        shards = self.shards
+        if task_ids is not None:
+            shards = [self.shards[index] for index in sorted({self.shard_index(task_id) for task_id in task_ids})]
+            if len(shards) == 1:
+                return shards[0].load()
+        
+        tasks = []
+        for shard, stored in zip(shards, self._read_shards(shards)):
+            tasks.extend(shard.adopt(stored) if isinstance(stored, str) else stored_tasks(stored))
+        tasks.sort(key=lambda task: task["id"])
+        return TaskTable(tasks)
+    
+    def scan(self) -> Iterator[dict[str, Any]]:
+        """Stream all shards merged in id order."""
+        # Each shard is written in id order, so a k-way merge keeps only one
+        # pending task per shard in memory.
+        streams = [
+            iter_decode_tasks(stored) if isinstance(stored, str) else stored_tasks(stored)
+            for stored in self._read_shards(self.shards)
+        ]
+        yield from heapq.merge(*streams, key=lambda task: task["id"])
+    
+    def stats(self) -> dict[str, Any]:
+        """Add up every shard's counts, reading only their metadata.
+        
+        Shards without metadata are counted in one streaming pass instead.
+        """
+        if not self.shards[0].metadata:
+            return super().stats()
+        counts = []
+        for shard in self.shards:
+            counts += stats_counts(shard.stats())
+        return count_stats(counts)
+    
+    def migrate(self) -> bool:
+        """Give tasks sharing an id fresh ones, then migrate each shard's format.
+        
+        A renumbered task usually belongs in another shard, so both the shard
+        it leaves and the one it joins are rewritten.
+        """
+        tasks = self.load()
+        touched = {self.shard_index(task["id"]) for task in tasks.duplicates}
+        touched.update(self.shard_index(task["id"]) for task in self._renumber_duplicates(tasks))
+        for index in touched:
+            self.shards[index].save(TaskTable(task for task in tasks if self.shard_index(task["id"]) == index), [])
+        migrated = [shard.migrate() for shard in self.shards]
+        return bool(touched) or any(migrated)
+    
+    def _read_shards(self, shards: list[JsonFileStorage]) -> list[str | Any]:
+        """Fetch the given shards in one read_multiple_files call.
+        
+        Shards come back as stored objects when the server keeps them and
+        as text otherwise.
+        """
+        result = self.mcp_server.call_tool(
+            "read_multiple_files",
+            {
+                "paths": [shard.path for shard in shards],
+                "as_object": self.mcp_server.store_objects
+            }
+        )
+        return result.get("values", result.get("contents"))
+    
+    def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Rewrite only the shards touched by records."""
+        touched: dict[int, list[dict[str, Any]]] = {}
+        for record in records:
+            touched.setdefault(self.shard_index(record_task_id(record)), []).append(record)
+        
+        for index, shard_records in touched.items():
+            shard_tasks = TaskTable(task for task in tasks if self.shard_index(task["id"]) == index)
+            self.shards[index].save(shard_tasks, shard_records)
+
+
+class SQLiteStorage(TaskStorage):
+    """Stores tasks as rows behind a SQLite MCP server.
+    
+    The id is the primary key and priority/completed are indexed, so
+    completing or deleting a task is one indexed row update, and listing
+    pages through rows with a keyset cursor instead of loading them all.
+    """
+    
+    def __init__(self, mcp_server: SimulatedSQLiteServer, batch_size: int = 500, id_block: int = 100):
+        self.mcp_server = mcp_server
+        self.batch_size = batch_size
+        self.ids = IdSequence(self._take_ids, id_block)
+        self.mcp_server.call_tool("create_table", {"query": SQLITE_SCHEMA})
+    
+    def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Fetch only the rows for task_ids when given, otherwise every row."""
+        if task_ids is None:
+            return TaskTable(self._select("SELECT * FROM tasks ORDER BY id"))
+        
+        rows = []
+        # batch_size ids per query keeps well under SQLite's parameter limit
+        for chunk in chunked(sorted(task_ids), self.batch_size):
+            placeholders = ", ".join("?" * len(chunk))
+            rows += self._select(f"SELECT * FROM tasks WHERE id IN ({placeholders}) ORDER BY id", tuple(chunk))
+        return TaskTable(rows)
+    
+    def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Apply records as row statements in one write_query call."""
+        batch = []
+        for record in records:
+            if record["op"] == "add":
+                task = record["task"]
+                params = [task["id"], task["description"], task["priority"], task["completed"]]
+            else:
+                params = [record["id"]]
+            batch.append({"query": SQLITE_STATEMENTS[record["op"]], "params": params})
+        if batch:
+            self.mcp_server.call_tool("write_query", {"batch": batch})
+    
+    def scan(self) -> Iterator[dict[str, Any]]:
+        """Stream rows in id order, batch_size rows per read_query call."""
+        yield from self.select()
+    
+    def select(self, priority: str | None = None, completed: bool | None = None) -> Iterator[dict[str, Any]]:
+        """Stream matching rows through the priority and completed indexes."""
+        last_id = 0
+        while True:
+            rows = self.page(last_id, self.batch_size, priority, completed)
+            yield from rows
+            if len(rows) < self.batch_size:
+                return
+            last_id = rows[-1]["id"]
+    
+    def page(
+        self,
+        after: int,
+        limit: int,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> list[dict[str, Any]]:
+        """Fetch one page by seeking past after on the primary key."""
+        conditions = ["id > ?"]
+        params: list[Any] = [after]
+        if priority is not None:
+            conditions.append("priority = ?")
+            params.append(priority)
+        if completed is not None:
+            conditions.append("completed = ?")
+            params.append(int(completed))
+        return self._select(
+            f"SELECT * FROM tasks WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?",
+            (*params, limit)
+        )
+    
+    def next_tasks(self, k: int) -> list[dict[str, Any]]:
+        """Fetch the k most urgent open tasks, one indexed query per priority."""
+        placeholders = ", ".join("?" * len(PRIORITIES))
+        queries = [("priority = ?", (priority,)) for priority in PRIORITIES]
+        queries.append((f"priority NOT IN ({placeholders})", PRIORITIES))
+        
+        found: list[dict[str, Any]] = []
+        for condition, params in queries:
+            if len(found) >= k:
+                break
+            found += self._select(
+                f"SELECT * FROM tasks WHERE completed = 0 AND {condition} ORDER BY id LIMIT ?",
+                (*params, k - len(found))
+            )
+        return found
+    
+    def stats(self) -> dict[str, Any]:
+        """Read the counts the triggers keep in task_stats."""
+        result = self.mcp_server.call_tool(
+            "read_query",
+            {"query": "SELECT priority, completed, count FROM task_stats"}
+        )
+        return count_stats(
+            (row["priority"], bool(row["completed"]), row["count"]) for row in result["rows"]
+        )
+    
+    def reserve_ids(self, count: int) -> int:
+        """Reserve ids from the task_ids row, id_block at a time."""
+        return self.ids.reserve(count)
+    
+    def _take_ids(self, count: int) -> int:
+        """Reserve count ids by moving the task_ids row on."""
+        self.mcp_server.call_tool(
+            "write_query",
+            {"query": "UPDATE task_ids SET next_id = next_id + ?", "params": (count,)}
+        )
+        result = self.mcp_server.call_tool("read_query", {"query": "SELECT next_id FROM task_ids"})
+        return result["rows"][0]["next_id"] - count
+    
+    def _select(self, query: str, params: tuple = ()) -> list[dict[str, Any]]:
+        """Run a read_query and convert its rows to task dictionaries."""
+        result = self.mcp_server.call_tool("read_query", {"query": query, "params": params})
+        return [dict(row, completed=bool(row["completed"])) for row in result["rows"]]
 
 
 class SimpleTaskManager:
     """Task manager using simulated MCP server."""
     
-    def __init__(self):
-        self.mcp_server = SimulatedMCPServer()
+    def __init__(self, storage: str = "json", store_objects: bool = False, **storage_options):
+        self.mcp_server = SimulatedMCPServer(store_objects=store_objects)
         self.tasks_file = "tasks.json"
+        self.storage = self._create_storage(storage, storage_options)
+        # Nothing but this manager writes to the simulated server, so a table
+        # read for searching stays current as long as our own changes are
+        # applied to it, and the indexes built on it are reused
+        self._kept: TaskTable | None = None
         print("🚀 Task Manager initialized with simulated MCP server")
     
+    def _create_storage(self, kind: str, options: dict[str, Any]):
+        """Build the storage backend named by kind."""
+        if kind == "json":
+            return JsonFileStorage(self.mcp_server, self.tasks_file, **options)
+        if kind == "sharded":
+            return ShardedStorage(self.mcp_server, self.tasks_file, **options)
+        if kind == "sqlite":
+            return SQLiteStorage(SimulatedSQLiteServer(), **options)
+        raise ValueError(f"Unknown storage: {kind}")
+    
     def show_available_tools(self):
         """Display available MCP tools."""
         print("\n📦 Available MCP Tools:")
@@ -64,85 +806,291 @@ class SimpleTaskManager:
     
     def add_task(self, description: str, priority: str = "medium"):
         """Add a new task using MCP server."""
-        # Read existing tasks via MCP
-        tasks = self._read_tasks()
+        # Reserve the id first, so storages that can locate it read only
+        # the row or shard it goes into
+        task_id = self.storage.reserve_ids(1)
+        tasks = self._read_tasks(None if task_id is None else (task_id,))
         
         # Create new task
         new_task = {
-            "id": len(tasks) + 1,
+            "id": task_id if task_id is not None else tasks.next_id(),
             "description": description,
             "priority": priority,
             "completed": False
         }
-        tasks.append(new_task)
+        record = {"op": "add", "task": new_task}
+        apply_record(tasks, record)
         
         # Write back via MCP
-        self._write_tasks(tasks)
+        self._write_tasks(tasks, [record])
         print(f"✅ Task added: {description} [Priority: {priority}]")
     
-    def list_tasks(self):
-        """List all tasks."""
-        tasks = self._read_tasks()
+    def add_tasks(self, new_tasks: Iterable[str | tuple[str, str]], chunk_size: int = 1000) -> list[dict[str, Any]]:
+        """Add many tasks with one read and one write per chunk_size tasks.
         
-        if not tasks:
+        Each item is a description or a (description, priority) pair.
+        """
+        added = []
+        for chunk in chunked(new_tasks, chunk_size):
+            # Ids for the whole chunk come from a single reservation
+            first_id = self.storage.reserve_ids(len(chunk))
+            if first_id is None:
+                tasks = self._read_tasks()
+                first_id = tasks.next_id()
+            else:
+                tasks = self._read_tasks(range(first_id, first_id + len(chunk)))
+            records = []
+            for offset, item in enumerate(chunk):
+                description, priority = (item, "medium") if isinstance(item, str) else item
+                record = {"op": "add", "task": {
+                    "id": first_id + offset,
+                    "description": description,
+                    "priority": priority,
+                    "completed": False
+                }}
+                added.append(apply_record(tasks, record))
+                records.append(record)
+            self._write_tasks(tasks, records)
+        print(f"✅ Added {len(added)} tasks")
+        return added
+    
+    def list_tasks(self, priority: str | None = None, completed: bool | None = None):
+        """List tasks, optionally only those with a priority or status."""
+        # Tasks are streamed so large lists are never held in memory at once
+        found = False
+        for task in self.iter_tasks(priority, completed):
+            if not found:
+                print("\n" + "=" * 70)
+                print("📋 YOUR TASKS")
+                print("=" * 70)
+                found = True
+            
+            self._print_task(task)
+        
+        if not found:
             print("\n📝 No tasks yet!")
             return
         
+        print("=" * 70)
+    
+    def list_page(
+        self,
+        cursor: str | None = None,
+        limit: int = 20,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> dict[str, Any]:
+        """Print and return one page of tasks in id order.
+        
+        Returns {"tasks": [...], "next_cursor": ...}; pass next_cursor back
+        to get the following page, until it is None. Cursors hold the last
+        id returned, so they survive tasks being added and deleted.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        # One extra task tells us whether there is a next page
+        tasks = self.storage.page(decode_cursor(cursor), limit + 1, priority, completed)
+        next_cursor = encode_cursor(tasks[limit - 1]["id"]) if len(tasks) > limit else None
+        tasks = tasks[:limit]
+        
+        if not tasks:
+            print("\n📝 No tasks yet!")
+            return {"tasks": [], "next_cursor": None}
+        
         print("\n" + "=" * 70)
         print("📋 YOUR TASKS")
         print("=" * 70)
-        
         for task in tasks:
-            status = "✅" if task["completed"] else "⬜"
-            priority_emoji = {
-                "high": "🔴",
-                "medium": "🟡", 
-                "low": "🟢"
-            }.get(task["priority"], "⚪")
-            
-            print(f"{status} [{task['id']}] {priority_emoji} {task['description']}")
+            self._print_task(task)
+        print("=" * 70)
+        if next_cursor:
+            print("➡️  More tasks on the next page")
+        return {"tasks": tasks, "next_cursor": next_cursor}
+    
+    def next_tasks(self, k: int = 5) -> list[dict[str, Any]]:
+        """Print and return the k open tasks to work on next.
+        
+        Tasks are ordered by priority, then oldest first, picked in one pass
+        that holds only k of them (or by indexed queries with SQLite).
+        """
+        upcoming = self.storage.next_tasks(k)
+        if not upcoming:
+            print("\n🎉 Nothing left to do!")
+            return []
         
+        print("\n" + "=" * 70)
+        print("🎯 NEXT UP")
+        print("=" * 70)
+        for task in upcoming:
+            self._print_task(task)
         print("=" * 70)
+        return upcoming
+    
+    def stats(self) -> dict[str, Any]:
+        """Print and return task counts by status and priority.
+        
+        SQLite, and JSON documents with metadata, keep the counts up to date
+        on every change and stored next to the tasks, so this never reads the
+        tasks themselves. Otherwise they are counted as the tasks stream past.
+        """
+        stats = self.storage.stats()
+        print(f"\n📊 {stats['total']} tasks: {stats['open']} open, {stats['completed']} completed")
+        for priority, group in stats["by_priority"].items():
+            print(f"   {priority}: {group['open']} open, {group['completed']} completed")
+        return stats
+    
+    def search_tasks(self, query: str, limit: int | None = 20) -> list[dict[str, Any]]:
+        """Print and return the tasks whose descriptions match query, best first.
+        
+        Words must all appear, "OR" separates alternatives and "word*"
+        matches by prefix. Goes through the text index of the table kept
+        between calls.
+        """
+        matches = self._kept_tasks().search(query, limit)
+        if not matches:
+            print(f"\n🔍 No tasks match '{query}'")
+            return []
+        
+        print("\n" + "=" * 70)
+        print(f"🔍 TASKS MATCHING '{query}'")
+        print("=" * 70)
+        for task in matches:
+            self._print_task(task)
+        print("=" * 70)
+        return matches
+    
+    def fuzzy_search_tasks(
+        self,
+        query: str,
+        limit: int | None = 20,
+        threshold: float = 0.5
+    ) -> list[dict[str, Any]]:
+        """Print and return the tasks whose descriptions roughly contain query.
+        
+        Misspellings and parts of words match; a task needs at least
+        threshold of the query's trigrams, and more of them rank higher.
+        Goes through the trigram index of the table kept between calls.
+        """
+        matches = self._kept_tasks().fuzzy_search(query, limit, threshold)
+        if not matches:
+            print(f"\n🔍 Nothing close to '{query}'")
+            return []
+        
+        print("\n" + "=" * 70)
+        print(f"🔍 TASKS LIKE '{query}'")
+        print("=" * 70)
+        for task in matches:
+            self._print_task(task)
+        print("=" * 70)
+        return matches
+    
+    @staticmethod
+    def _print_task(task: dict[str, Any]):
+        """Print one task as a line of a listing."""
+        status = "✅" if task["completed"] else "⬜"
+        priority_emoji = {
+            "high": "🔴",
+            "medium": "🟡", 
+            "low": "🟢"
+        }.get(task["priority"], "⚪")
+        
+        print(f"{status} [{task['id']}] {priority_emoji} {task['description']}")
+    
+    def iter_tasks(self, priority: str | None = None, completed: bool | None = None) -> Iterator[dict[str, Any]]:
+        """Yield tasks one at a time, parsing them as they are read.
+        
+        Filtering by priority or completed goes through SQLite's indexes,
+        so it only touches the matching rows; the other storages filter as
+        the tasks stream past.
+        """
+        if priority is None and completed is None:
+            yield from self.storage.scan()
+        else:
+            yield from self.storage.select(priority, completed)
     
     def complete_task(self, task_id: int):
         """Mark task as complete."""
-        tasks = self._read_tasks()
+        tasks = self._read_tasks((task_id,))
         
-        for task in tasks:
-            if task["id"] == task_id:
-                task["completed"] = True
-                self._write_tasks(tasks)
-                print(f"✅ Task {task_id} completed!")
-                return
+        record = {"op": "complete", "id": task_id}
+        if apply_record(tasks, record) is None:
+            print(f"❌ Task {task_id} not found")
+            return
         
-        print(f"❌ Task {task_id} not found")
+        self._write_tasks(tasks, [record])
+        print(f"✅ Task {task_id} completed!")
     
     def delete_task(self, task_id: int):
         """Delete a task."""
-        tasks = self._read_tasks()
-        tasks = [t for t in tasks if t["id"] != task_id]
-        self._write_tasks(tasks)
+        tasks = self._read_tasks((task_id,))
+        record = {"op": "delete", "id": task_id}
+        apply_record(tasks, record)
+        self._write_tasks(tasks, [record])
         print(f"🗑️  Task {task_id} deleted!")
     
-    def _read_tasks(self) -> list[dict[str, Any]]:
-        """Read tasks using MCP server's read_file tool."""
-        result = self.mcp_server.call_tool(
-            "read_file",
-            {"path": self.tasks_file}
-        )
+    def complete_tasks(self, task_ids: Iterable[int], chunk_size: int = 1000) -> list[bool]:
+        """Complete many tasks, returning whether each id was found."""
+        found = self._apply_to_ids("complete", task_ids, chunk_size)
+        print(f"✅ Completed {sum(found)} of {len(found)} tasks")
+        return found
+    
+    def delete_tasks(self, task_ids: Iterable[int], chunk_size: int = 1000) -> list[bool]:
+        """Delete many tasks, returning whether each id was found."""
+        found = self._apply_to_ids("delete", task_ids, chunk_size)
+        print(f"🗑️  Deleted {sum(found)} of {len(found)} tasks")
+        return found
+    
+    def _apply_to_ids(self, op: str, task_ids: Iterable[int], chunk_size: int) -> list[bool]:
+        """Apply op to every id with one read and one write per chunk."""
+        found = []
+        for chunk in chunked(task_ids, chunk_size):
+            tasks = self._read_tasks(chunk)
+            records = []
+            for task_id in chunk:
+                record = {"op": op, "id": task_id}
+                found.append(apply_record(tasks, record) is not None)
+                if found[-1]:
+                    records.append(record)
+            if records:
+                self._write_tasks(tasks, records)
+        return found
+    
+    @contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        """Read the tasks once, stage changes, and save them in one write.
         
-        content = result.get("content", "[]")
-        return json.loads(content)
+        Changes are dropped if the block raises.
+        """
+        tx = Transaction(self._read_tasks())
+        yield tx
+        if tx.added:
+            first_id = self.storage.reserve_ids(len(tx.added))
+            if first_id is not None:
+                tx.renumber(first_id)
+        if tx.records:
+            self._write_tasks(tx.tasks, tx.records)
+        print(f"✅ Transaction committed ({len(tx.records)} changes)")
     
-    def _write_tasks(self, tasks: list[dict[str, Any]]):
-        """Write tasks using MCP server's write_file tool."""
-        self.mcp_server.call_tool(
-            "write_file",
-            {
-                "path": self.tasks_file,
-                "content": json.dumps(tasks, indent=2)
-            }
-        )
+    def _read_tasks(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Read tasks through the configured storage."""
+        return self.storage.load(task_ids)
+    
+    def _write_tasks(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Write tasks through the configured storage and into the kept table."""
+        self.storage.save(tasks, records)
+        if self._kept is not None:
+            for record in records:
+                if record["op"] == "add":
+                    # The kept table gets its own copy, so changing it never
+                    # touches a task dict handed to the caller
+                    record = {"op": "add", "task": dict(record["task"])}
+                apply_record(self._kept, record)
+    
+    def _kept_tasks(self) -> TaskTable:
+        """Return the table kept between calls, reading it on first use."""
+        if self._kept is None:
+            self._kept = self.storage.load()
+        return self._kept
 
 
 def print_header(text: str):
@@ -194,6 +1142,7 @@ def main():
     manager.list_tasks()
     
     print_header("✨ DEMO COMPLETE")
+    print(f"\n📊 Bytes moved through MCP tools: {manager.mcp_server.bytes_moved:,}")
     print("\n🎓 Key Takeaways:")
     print("   1. The app never directly accesses files")
     print("   2. All operations go through MCP server tools")
@@ -8,18 +8,1437 @@ interact with a filesystem MCP server.
 """
 
 import asyncio
+import hashlib
+import heapq
 import json
-from typing import Any
+import os
+import random
+import socket
+import sqlite3
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Collection, Iterable
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+from task_data import (
+    FORMATS,
+    FuzzyScan,
+    NextTaskScan,
+    PRIORITIES,
+    SQLITE_SCHEMA,
+    SQLITE_STATEMENTS,
+    SearchScan,
+    TaskTable,
+    Transaction,
+    apply_record,
+    VERSION_PREFIX,
+    chunked,
+    count_stats,
+    decode_cursor,
+    decode_tasks,
+    detect_format,
+    document_meta,
+    encode_cursor,
+    encode_document,
+    iter_decode_tasks,
+    matches_status,
+    read_meta,
+    record_task_id,
+    split_document,
+    split_version,
+    stats_counts,
+)
+
+
+# Marker that starts the line always ending the operation log, followed by
+# the task counts as of the last record. Records are inserted just above it
+# with edit_file, which is how we append through a server that only offers
+# whole-file writes and targeted edits.
+LOG_END = "#end"
+
+# get_file_info reports mtimes with one-second resolution, so a file modified
+# this recently could change again without its reported version changing.
+RACY_WINDOW = 2.0
+
+DEFAULT_TOOL_CACHE = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "mcp_task_manager" / "tools.json"
+)
+
+
+class ToolError(RuntimeError):
+    """Raised when an MCP tool call reports an error."""
+
+
+class VersionConflict(RuntimeError):
+    """Raised when a versioned write finds the file changed since it was read."""
+
+
+class LockTimeout(RuntimeError):
+    """Raised when a lease lock isn't granted within its timeout."""
+
+
+class LockLost(RuntimeError):
+    """Raised before a write when our lease on the lock has run out."""
+
+
+def edit_safe(text: str) -> str:
+    """Escape JSON text so it can be sent as edit_file's newText."""
+    # edit_file applies newText with JavaScript's String.replace, which would
+    # expand "$&"-style patterns, so "$" is written as its JSON escape.
+    return text.replace("$", "\\u0024")
+
+
+def dump_record(record: dict[str, Any]) -> str:
+    """Serialize a mutation record as a single log line."""
+    return edit_safe(json.dumps(record)) + "\n"
+
+
+def recently_modified(modified: str) -> bool:
+    """Check whether a get_file_info mtime falls inside RACY_WINDOW."""
+    try:
+        when = datetime.fromisoformat(modified.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            # Date.toString() style: "Sat Oct 17 2026 10:00:00 GMT+0000 (...)"
+            when = datetime.strptime(modified[:33], "%a %b %d %Y %H:%M:%S GMT%z")
+        except ValueError:
+            return False
+    return time.time() - when.timestamp() < RACY_WINDOW
+
+
+def minimal_edit(old: str, new: str) -> dict[str, str]:
+    """Compute one edit_file edit that turns old into new.
+    
+    Unchanged lines are trimmed from both ends, then the remaining block is
+    widened with neighbouring lines until its old text occurs exactly once,
+    which is what edit_file needs to apply it unambiguously.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    
+    start = 0
+    limit = min(len(old_lines), len(new_lines))
+    while start < limit and old_lines[start] == new_lines[start]:
+        start += 1
+    old_end, new_end = len(old_lines), len(new_lines)
+    while old_end > start and new_end > start and old_lines[old_end - 1] == new_lines[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+    
+    while True:
+        old_text = "".join(old_lines[start:old_end])
+        first = old.find(old_text) if old_text else -1
+        if first != -1 and old.find(old_text, first + 1) == -1:
+            break
+        if start > 0:
+            start -= 1
+        elif old_end < len(old_lines):
+            old_end += 1
+            new_end += 1
+        else:
+            break
+    return {"oldText": old_text, "newText": "".join(new_lines[start:new_end])}
+
+
+def document_edits(old: str, new: str) -> list[dict[str, str]] | None:
+    """Compute edit_file edits that turn one task document into another.
+    
+    The version header, the tasks and the metadata trailer are edited
+    separately, so a change in the middle of the tasks doesn't drag the rest
+    of the document into the trailer's edit. Returns None when old lacks a
+    part new has, or when the edits would not reproduce new exactly.
+    """
+    edits = []
+    for part, (old_part, new_part) in enumerate(zip(split_document(old), split_document(new))):
+        if old_part == new_part:
+            continue
+        edit = minimal_edit(old_part, new_part) if part == 1 else {"oldText": old_part, "newText": new_part}
+        if not edit["oldText"]:
+            return None
+        edits.append(edit)
+    
+    # edit_file replaces the first match of each edit in turn; check that
+    # doing so on old really gives new
+    text = old
+    for edit in edits:
+        start = text.find(edit["oldText"])
+        if start == -1:
+            return None
+        text = text[:start] + edit["newText"] + text[start + len(edit["oldText"]):]
+    return edits if text == new else None
+
+
+class ToolCatalogCache:
+    """Keeps each server's tool list on disk between runs.
+    
+    Entries are keyed by the command used to start the server and the name
+    and version it reports, so upgrading the server starts a fresh entry.
+    """
+    
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+    
+    def key(self, command: str, args: list[str], server_info: Any) -> str:
+        """Build the cache key for one server."""
+        identity = [
+            command,
+            list(args),
+            getattr(server_info, "name", ""),
+            getattr(server_info, "version", "")
+        ]
+        return hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+    
+    def load(self, key: str) -> list[dict[str, str]] | None:
+        """Return the cached tools for key, or None if there are none."""
+        return self._read().get(key)
+    
+    def store(self, key: str, tools: list[dict[str, str]]):
+        """Save the tools for key, replacing the file atomically."""
+        entries = self._read()
+        entries[key] = tools
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(entries, indent=2))
+        os.replace(temporary, self.path)
+    
+    def _read(self) -> dict[str, list[dict[str, str]]]:
+        """Read every cached entry, treating a missing or broken file as empty."""
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+
+class LeaseLock:
+    """A lock shared between processes through a file on the MCP server.
+    
+    The lock file holds the current holder, when its lease runs out, and a
+    queue of waiters that is served first come, first served. Every change
+    is an edit_file replacing the exact text we read, so a process that
+    read a stale state loses. Holders renew their lease in the background
+    and waiters refresh their place in the queue; anyone who stops (say, by
+    crashing) is dropped once their lease expires. A holder that could not
+    renew in time finds out from check() before it writes.
+    
+    The lock is best-effort. The filesystem server reads, edits and writes
+    a file in separate steps, and each worker talks to its own server
+    process, so two edits landing at the same moment can both succeed.
+    Use it to make workers take turns, not where two holders at once would
+    corrupt data.
+    
+    The lock file must exist before workers use it; create() makes it once.
+    """
+    
+    def __init__(
+        self,
+        call_tool,
+        path: str,
+        lease: float = 10.0,
+        timeout: float = 30.0,
+        poll_interval: float = 0.05,
+    ):
+        self.call_tool = call_tool
+        self.path = path
+        self.lease = lease
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.metrics = {
+            "acquired": 0,
+            "contended": 0,
+            "timeouts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+        self._renewer: asyncio.Task | None = None
+        self._expires = 0.0
+        self._lost = False
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.release()
+    
+    async def create(self) -> bool:
+        """Write an empty lock file if there is none; True if one was written.
+        
+        Run this once before workers start. Workers never create the file
+        themselves, since two doing so at once could each overwrite the
+        other's hold.
+        """
+        try:
+            await self.call_tool("read_file", {"path": self.path})
+            return False
+        except ToolError:
+            text = json.dumps({"seq": 0, "holder": None, "expires": 0, "waiters": []}) + "\n"
+            await self.call_tool("write_file", {"path": self.path, "content": text})
+            return True
+    
+    def check(self):
+        """Raise LockLost unless we still hold the lock with time to spare."""
+        if self._lost or time.time() >= self._expires:
+            raise LockLost(f"Lease on {self.path} ran out before the write")
+    
+    async def acquire(self):
+        """Wait for our turn and take the lock, raising LockTimeout if it never comes."""
+        started = time.monotonic()
+        contended = False
+        while True:
+            text, state = await self._read()
+            now = time.time()
+            waiters = state["waiters"]
+            if state["holder"] is None and (not waiters or waiters[0]["owner"] == self.owner):
+                state["holder"] = self.owner
+                state["expires"] = now + self.lease
+                state["waiters"] = [waiter for waiter in waiters if waiter["owner"] != self.owner]
+                if await self._swap(text, state):
+                    self._expires = state["expires"]
+                    self._lost = False
+                    break
+                continue
+            
+            contended = True
+            if time.monotonic() - started >= self.timeout:
+                self.metrics["timeouts"] += 1
+                await self._leave_queue()
+                raise LockTimeout(f"Timed out waiting for {self.path} (held by {state['holder']})")
+            
+            # Join the queue, or refresh our place before it expires
+            entry = next((waiter for waiter in waiters if waiter["owner"] == self.owner), None)
+            if entry is None or entry["expires"] - now < self.lease / 2:
+                if entry is None:
+                    waiters.append(entry := {"owner": self.owner})
+                entry["expires"] = now + self.lease
+                await self._swap(text, state)
+            await asyncio.sleep(self.poll_interval)
+        
+        waited = time.monotonic() - started
+        self.metrics["acquired"] += 1
+        self.metrics["contended"] += contended
+        self.metrics["wait_total"] += waited
+        self.metrics["wait_max"] = max(self.metrics["wait_max"], waited)
+        self._renewer = asyncio.create_task(self._renew_loop())
+    
+    async def release(self):
+        """Give the lock up, unless our lease already ran out."""
+        self._expires = 0.0
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        while True:
+            text, state = await self._read()
+            if state["holder"] != self.owner:
+                return
+            state["holder"] = None
+            state["expires"] = 0
+            if await self._swap(text, state):
+                return
+    
+    async def _renew_loop(self):
+        """Extend our lease while we hold the lock."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            # Losing a swap to a waiter refreshing its place is normal, so
+            # retry straight away rather than letting the lease run down
+            while True:
+                try:
+                    text, state = await self._read()
+                except ToolError:
+                    # Try again next round; the lease still has time left
+                    break
+                if state["holder"] != self.owner:
+                    self._lost = True
+                    return
+                state["expires"] = time.time() + self.lease
+                if await self._swap(text, state):
+                    self._expires = state["expires"]
+                    break
+    
+    async def _leave_queue(self):
+        """Take ourselves out of the waiters after giving up."""
+        for _ in range(3):
+            text, state = await self._read()
+            waiters = [waiter for waiter in state["waiters"] if waiter["owner"] != self.owner]
+            if len(waiters) == len(state["waiters"]):
+                return
+            state["waiters"] = waiters
+            if await self._swap(text, state):
+                return
+    
+    async def _read(self) -> tuple[str, dict[str, Any]]:
+        """Return the lock file text and its state with expired entries dropped."""
+        text = await self.call_tool("read_file", {"path": self.path})
+        state = json.loads(text)
+        now = time.time()
+        if state["holder"] is not None and state["expires"] <= now:
+            state["holder"] = None
+        state["waiters"] = [waiter for waiter in state["waiters"] if waiter["expires"] > now]
+        return text, state
+    
+    async def _swap(self, text: str, state: dict[str, Any]) -> bool:
+        """Replace the lock file if it still reads text; False if someone beat us."""
+        # seq changes on every write, so an old text can never match again
+        state["seq"] += 1
+        edit = {"oldText": text, "newText": edit_safe(json.dumps(state)) + "\n"}
+        try:
+            await self.call_tool("edit_file", {"path": self.path, "edits": [edit]})
+        except ToolError:
+            return False
+        return True
+
+
+class IdSequence:
+    """Hands out task ids that are never used twice, even after a delete.
+    
+    take(count) reserves count consecutive ids in persistent storage and
+    returns the first. Ids are taken at least block at a time and handed out
+    from memory until the block runs out, and requests that arrive while a
+    reservation is under way are served together by the next one, so most
+    add_task calls cost no reservation at all. Ids left in a block when the
+    process exits are skipped, never reused.
+    """
+    
+    def __init__(self, take, block: int = 1):
+        self.take = take
+        self.block = block
+        # The reserved ids not handed out yet: [_next, _end)
+        self._next = self._end = 0
+        self._pending: list[tuple[int, asyncio.Future]] = []
+        self._reserver: asyncio.Task | None = None
+    
+    async def reserve(self, count: int) -> int:
+        """Reserve count consecutive ids and return the first."""
+        idle = self._reserver is None or self._reserver.done()
+        if idle and self._end - self._next >= count:
+            first_id = self._next
+            self._next += count
+            return first_id
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((count, future))
+        if self._reserver is None or self._reserver.done():
+            self._reserver = asyncio.create_task(self._reserve_loop())
+        return await future
+    
+    async def _reserve_loop(self):
+        """Serve pending requests, one reservation per batch."""
+        while self._pending:
+            batch, self._pending = self._pending, []
+            needed = sum(count for count, _ in batch)
+            if self._end - self._next < needed:
+                size = max(needed, self.block)
+                try:
+                    self._next = await self.take(size)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self._end = self._next + size
+            for count, future in batch:
+                if not future.done():
+                    future.set_result(self._next)
+                self._next += count
+
+
+class IdFile:
+    """The next unused task id, kept in a small JSON file on the MCP server.
+    
+    Reservations replace the exact text they read through edit_file, and the
+    number only grows, so a process that read a stale number retries. Like
+    LeaseLock this is best-effort: edit_file is not atomic across server
+    processes, so two reservations at the same moment can overlap. A file
+    that does not exist yet starts at first_free(), the id after the highest
+    one already stored.
+    """
+    
+    def __init__(self, call_tool, path: str, first_free):
+        self.call_tool = call_tool
+        self.path = path
+        self.first_free = first_free
+    
+    async def take(self, count: int) -> int:
+        """Reserve count ids and return the first."""
+        while True:
+            try:
+                text = await self.call_tool("read_file", {"path": self.path})
+            except ToolError:
+                text = json.dumps({"next_id": await self.first_free()}) + "\n"
+                await self.call_tool("write_file", {"path": self.path, "content": text})
+            
+            next_id = json.loads(text)["next_id"]
+            if count == 0:
+                return next_id
+            edit = {"oldText": text, "newText": json.dumps({"next_id": next_id + count}) + "\n"}
+            try:
+                await self.call_tool("edit_file", {"path": self.path, "edits": [edit]})
+            except ToolError:
+                # Another process reserved ids since we read the file
+                continue
+            return next_id
+
+
+class TaskStorage:
+    """Base class for task storage backends."""
+    
+    def required_tools(self) -> set[str]:
+        """Name the MCP tools this storage calls."""
+        return set()
+    
+    async def start(self):
+        """Start any background work once the server connection is up."""
+    
+    async def close(self):
+        """Stop background work before the server connection goes away."""
+    
+    def keeps_tasks(self) -> bool:
+        """Tell whether load() returns the same table until the tasks change.
+        
+        Indexes built on such a table are reused by later queries; otherwise
+        a one-off query is cheaper as a scan.
+        """
+        return False
+    
+    async def load_for_update(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Load tasks that the caller will change in place and then save."""
+        return await self.load(task_ids)
+    
+    def discard(self):
+        """Forget any tasks kept in memory after a change to them failed to save."""
+    
+    async def scan(self) -> AsyncIterator[dict[str, Any]]:
+        """Yield every task in id order."""
+        for task in await self.load():
+            yield task
+    
+    async def select(self, priority: str | None = None, completed: bool | None = None) -> AsyncIterator[dict[str, Any]]:
+        """Yield the tasks with the given priority and/or completion status.
+        
+        A kept table answers from its status index. Otherwise the tasks are
+        filtered as they stream past, rather than indexed for one query.
+        """
+        if self.keeps_tasks():
+            for task in (await self.load()).select(priority, completed):
+                yield task
+            return
+        async for task in self.scan():
+            if matches_status(task, priority, completed):
+                yield task
+    
+    async def page(
+        self,
+        after: int,
+        limit: int,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> list[dict[str, Any]]:
+        """Return up to limit matching tasks with ids greater than after.
+        
+        A kept table finds the start with a binary search. Otherwise the
+        tasks stream past in id order and parsing stops once the page is full.
+        """
+        if self.keeps_tasks():
+            return (await self.load()).page(after, limit, priority, completed)
+        found: list[dict[str, Any]] = []
+        if limit < 1:
+            return found
+        async for task in self.select(priority, completed):
+            if task["id"] > after:
+                found.append(task)
+                if len(found) == limit:
+                    break
+        return found
+    
+    async def next_tasks(self, k: int) -> list[dict[str, Any]]:
+        """Return the k most urgent open tasks.
+        
+        A kept table answers from its heap; otherwise one pass over the
+        tasks keeps only the best k.
+        """
+        if self.keeps_tasks():
+            return (await self.load()).next_tasks(k)
+        scan = NextTaskScan(k)
+        async for task in self.scan():
+            scan.add(task)
+        return scan.results()
+    
+    async def stats(self) -> dict[str, Any]:
+        """Count tasks by status and priority, streaming them unless the table is kept."""
+        if self.keeps_tasks():
+            return (await self.load()).stats()
+        counts: Counter[tuple[str, bool]] = Counter()
+        async for task in self.scan():
+            counts[task["priority"], task["completed"]] += 1
+        return count_stats((priority, completed, count) for (priority, completed), count in counts.items())
+    
+    async def reserve_ids(self, count: int) -> int | None:
+        """Reserve count new task ids and return the first.
+        
+        Returns None when new tasks should take the task table's next_id()
+        as they are saved instead. Storages that save the whole table, and
+        the next id with it, need no separate counter.
+        """
+        return None
+    
+    async def _first_free_id(self) -> int:
+        """Return the id after the highest one stored, to start a sequence."""
+        return (await self.load()).next_id()
+    
+    async def _renumber_duplicates(self, tasks: TaskTable) -> list[dict[str, Any]]:
+        """Give tasks that repeat an earlier id fresh ids, reserved like new ones."""
+        if not tasks.duplicates:
+            return []
+        return tasks.renumber_duplicates(await self.reserve_ids(len(tasks.duplicates)))
+
+
+class JsonFileStorage(TaskStorage):
+    """Stores the whole task list as one JSON document.
+    
+    format is "array" (the original pretty-printed list) or "ndjson" (one
+    task per line). Files are read in whichever format they are in and
+    rewritten in the configured one, which is how array files migrate.
+    
+    With diff_writes enabled the storage remembers the text it last read or
+    wrote and sends only the changed lines through edit_file, falling back
+    to write_file when the edit would exceed edit_threshold of the document
+    or the file no longer matches what we last saw. With NDJSON an added
+    task is a one-line edit at the end of the file.
+    
+    With cache_reads enabled the parsed list is kept together with the
+    file's size and mtime from get_file_info. Later reads probe those first
+    and skip read_file while they are unchanged, which stays safe when other
+    processes write the same file. Our own writes drop the cache.
+    
+    With versioned enabled the file starts with a "#version N" line and
+    every save is an edit_file that also replaces that exact line with
+    N + 1. If another process saved in between, the edit finds no match and
+    save raises VersionConflict instead of overwriting their changes. The
+    check is best-effort: edit_file is not atomic across server processes,
+    so two saves at the very same moment can both pass it. A file without a
+    header is taken over unconditionally, so create it once with migrate()
+    before several processes start sharing it.
+    
+    With metadata enabled the document ends with a "#meta" line holding the
+    task counts and the next id, written in the same call as the tasks, so
+    stats() reads just that line and new ids need no separate counter. The
+    file is then no longer plain JSON, so only enable it when every reader
+    goes through this storage. Otherwise ids come from "<path>.ids",
+    id_block at a time, and stats() counts the tasks as it streams them.
+    """
+    
+    def __init__(
+        self,
+        call_tool,
+        path: str,
+        format: str = "array",
+        diff_writes: bool = True,
+        edit_threshold: float = 0.5,
+        cache_reads: bool = False,
+        versioned: bool = False,
+        metadata: bool = False,
+        id_block: int = 100,
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format: {format}")
+        self.call_tool = call_tool
+        self.path = path
+        self.format = format
+        self.diff_writes = diff_writes
+        self.edit_threshold = edit_threshold
+        self.cache_reads = cache_reads
+        self.versioned = versioned
+        self.metadata = metadata
+        self.ids = IdSequence(IdFile(call_tool, f"{path}.ids", self._first_free_id).take, id_block)
+        self._content: str | None = None
+        self._version = 0
+        self._cached: TaskTable | None = None
+        self._cached_version: tuple[str, str] | None = None
+    
+    def required_tools(self) -> set[str]:
+        """Name the MCP tools this storage calls."""
+        tools = {"read_file", "write_file", "edit_file"}
+        if self.cache_reads:
+            tools.add("get_file_info")
+        return tools
+    
+    def keeps_tasks(self) -> bool:
+        """Tell whether parsed tasks are cached between reads."""
+        return self.cache_reads
+    
+    async def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Read and parse the task document."""
+        version = await self._probe() if self.cache_reads else None
+        if version is not None and version == self._cached_version:
+            return self._cached
+        
+        try:
+            content = await self.call_tool("read_file", {"path": self.path})
+            tasks = self.adopt(content)
+        except Exception:
+            # File doesn't exist yet, return empty list
+            self._content = None
+            self._version = 0
+            return TaskTable()
+        
+        # A file written within the last moment might change again without
+        # its version changing, so only cache once it has settled
+        if version is not None and not recently_modified(version[1]):
+            self._cached, self._cached_version = tasks, version
+        return tasks
+    
+    async def load_for_update(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Load tasks to be changed, taking them out of the read cache.
+        
+        Other readers must not see the change before it is saved, and the
+        cache must not keep it if the save never happens.
+        """
+        tasks = await self.load(task_ids)
+        self.discard()
+        return tasks
+    
+    def discard(self):
+        """Drop the cached tasks."""
+        self._cached, self._cached_version = None, None
+    
+    async def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Write the new document, with its counts when metadata is on."""
+        await self._write_document(tasks)
+    
+    async def reserve_ids(self, count: int) -> int | None:
+        """Reserve ids from "<path>.ids", unless the document keeps the next id."""
+        if self.metadata:
+            return None
+        return await self.ids.reserve(count)
+    
+    async def stats(self) -> dict[str, Any]:
+        """Read the task counts from the document's last line when it has them."""
+        if not self.metadata:
+            return await super().stats()
+        try:
+            last = await self.call_tool("read_file", {"path": self.path, "tail": 1})
+        except ToolError:
+            # No document yet
+            return TaskTable().stats()
+        meta = read_meta(last)
+        if meta is None:
+            # Written before the counts were; count the tasks instead
+            return await super().stats()
+        return meta["stats"]
+    
+    async def _write_document(self, tasks: TaskTable):
+        """Write the task document, as targeted edits when those are smaller."""
+        self.discard()
+        content = self.encode(tasks)
+        if self.versioned:
+            await self._save_versioned(content)
+            return
+        edits = self._edits(content)
+        if edits is not None:
+            try:
+                await self.call_tool("edit_file", {"path": self.path, "edits": edits})
+                self._content = content
+                return
+            except ToolError:
+                # Someone else changed the file; rewrite it in full
+                pass
+        
+        await self.call_tool("write_file", {"path": self.path, "content": content})
+        self._content = content
+    
+    def _edits(self, content: str) -> list[dict[str, str]] | None:
+        """Return edits turning the text we last saw into content.
+        
+        Returns None when diffing is off or a full write would be about as
+        small.
+        """
+        if not self.diff_writes or self._content is None:
+            return None
+        edits = document_edits(self._content, content)
+        if edits is None:
+            return None
+        size = sum(len(edit["oldText"]) + len(edit["newText"]) for edit in edits)
+        return edits if size <= self.edit_threshold * len(content) else None
+    
+    async def _save_versioned(self, body: str):
+        """Write body only if the file is still at the version we loaded."""
+        old_version = split_version(self._content or "")[0]
+        if old_version != self._version:
+            # The text we would diff against is newer than what we loaded
+            raise VersionConflict(f"{self.path} changed since version {self._version}")
+        
+        content = f"{VERSION_PREFIX}{self._version + 1}\n" + body
+        if not old_version:
+            # A new file, or one saved without versioning, has no header to
+            # check against, so it is taken over with a plain write
+            await self.call_tool("write_file", {"path": self.path, "content": content})
+        else:
+            # The old text starts with its unique header, and the first edit
+            # replaces it, so the edits only match if nobody has saved since
+            edits = self._edits(content) or [{"oldText": self._content, "newText": content}]
+            try:
+                await self.call_tool("edit_file", {"path": self.path, "edits": edits})
+            except ToolError as e:
+                raise VersionConflict(f"{self.path} changed since version {self._version}") from e
+        self._content = content
+        self._version += 1
+    
+    async def scan(self) -> AsyncIterator[dict[str, Any]]:
+        """Stream tasks from the document text without building the list."""
+        if self.cache_reads:
+            # Caching needs the parsed list, so go through the cached load
+            for task in await self.load():
+                yield task
+            return
+        
+        try:
+            content = await self.call_tool("read_file", {"path": self.path})
+        except ToolError:
+            return
+        self._content = content
+        for task in iter_decode_tasks(content):
+            yield task
+    
+    async def migrate(self) -> bool:
+        """Bring the file up to date, returning whether it had to be rewritten.
+        
+        Tasks sharing an id get fresh ones, a file in another format is
+        rewritten in the configured one, and a versioned storage adds the
+        version header.
+        """
+        tasks = await self.load()
+        renumbered = await self._renumber_duplicates(tasks)
+        reformat = detect_format(self._content or "") not in (None, self.format)
+        needs_header = self.versioned and not split_version(self._content or "")[0]
+        if not (renumbered or reformat or needs_header):
+            return False
+        if reformat and not self.versioned:
+            # Diffing across formats would touch every line, so write it whole
+            self._content = None
+        await self.save(tasks, [])
+        return True
+    
+    async def _probe(self) -> tuple[str, str] | None:
+        """Return the file's (size, modified) from get_file_info, if it exists."""
+        try:
+            info = await self.call_tool("get_file_info", {"path": self.path})
+        except ToolError:
+            return None
+        fields = dict(line.split(": ", 1) for line in info.splitlines() if ": " in line)
+        if "size" not in fields or "modified" not in fields:
+            return None
+        return fields["size"], fields["modified"]
+    
+    def adopt(self, content: str) -> TaskTable:
+        """Parse text read from the server and remember it for diffing."""
+        self._content = content
+        self._version = split_version(content)[0]
+        return self.decode(content)
+    
+    def decode(self, content: str) -> TaskTable:
+        """Parse the document text into a task list."""
+        meta = read_meta(content) or {}
+        return TaskTable(decode_tasks(content), meta.get("next_id", 1))
+    
+    def encode(self, tasks: TaskTable) -> str:
+        """Render a task list as document text."""
+        return edit_safe(encode_document(tasks, self.format, self.metadata))
+
+
+class ShardedStorage(TaskStorage):
+    """Spreads tasks over several JSON documents keyed by a hash of the id.
+    
+    Completing or deleting a task reads and rewrites only the shard holding
+    it, so write cost follows shard size rather than the size of the whole
+    list. Full reads fetch every shard in one read_multiple_files call.
+    """
+    
+    def __init__(self, call_tool, path: str, shards: int = 8, id_block: int = 100, **shard_options):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        if shard_options.get("versioned"):
+            # A change can span shards, and they can't be swapped in one step
+            raise ValueError("versioned writes need a single document; use storage='json'")
+        self.call_tool = call_tool
+        self.ids = IdSequence(IdFile(call_tool, f"{path}.ids", self._first_free_id).take, id_block)
+        stem = path.removesuffix(".json")
+        self.shards = [
+            JsonFileStorage(call_tool, f"{stem}.shard-{index:02d}.json", **shard_options)
+            for index in range(shards)
+        ]
+    
+    def required_tools(self) -> set[str]:
+        """Name the MCP tools this storage calls."""
+        return {"read_multiple_files"} | self.shards[0].required_tools()
+    
+    def shard_index(self, task_id: int) -> int:
+        """Return the index of the shard that owns task_id."""
+        # crc32 rather than hash() so every process agrees on the layout
+        return zlib.crc32(str(task_id).encode()) % len(self.shards)
+    
+    async def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Read only the shards holding task_ids when given, otherwise all of them."""
+        indexes = None
+        if task_ids is not None:
+            indexes = sorted({self.shard_index(task_id) for task_id in task_ids})
+            if len(indexes) == 1:
+                return await self.shards[indexes[0]].load()
+        
+        tasks = []
+        for shard, content in await self._read_shards(indexes):
+            tasks.extend(shard.adopt(content))
+        tasks.sort(key=lambda task: task["id"])
+        return TaskTable(tasks)
+    
+    async def reserve_ids(self, count: int) -> int:
+        """Reserve ids from "<path>.ids", id_block at a time.
+        
+        Each shard only sees its own tasks, so the next id is kept apart.
+        """
+        return await self.ids.reserve(count)
+    
+    async def scan(self) -> AsyncIterator[dict[str, Any]]:
+        """Stream all shards merged in id order."""
+        # Each shard is written in id order, so a k-way merge keeps only one
+        # pending task per shard in memory.
+        streams = [iter_decode_tasks(content) for _, content in await self._read_shards()]
+        for task in heapq.merge(*streams, key=lambda task: task["id"]):
+            yield task
+    
+    async def stats(self) -> dict[str, Any]:
+        """Add up every shard's counts, reading their last lines concurrently.
+        
+        Shards without metadata are counted in one streaming pass instead.
+        """
+        if not self.shards[0].metadata:
+            return await super().stats()
+        counts = []
+        for stats in await asyncio.gather(*(shard.stats() for shard in self.shards)):
+            counts += stats_counts(stats)
+        return count_stats(counts)
+    
+    async def migrate(self) -> bool:
+        """Give tasks sharing an id fresh ones, then migrate each shard's format.
+        
+        A renumbered task usually belongs in another shard, so both the shard
+        it leaves and the one it joins are rewritten.
+        """
+        tasks = await self.load()
+        touched = {self.shard_index(task["id"]) for task in tasks.duplicates}
+        touched.update(self.shard_index(task["id"]) for task in await self._renumber_duplicates(tasks))
+        await asyncio.gather(*(
+            self.shards[index].save(
+                TaskTable(task for task in tasks if self.shard_index(task["id"]) == index), []
+            )
+            for index in touched
+        ))
+        migrated = await asyncio.gather(*(shard.migrate() for shard in self.shards))
+        return bool(touched) or any(migrated)
+    
+    async def _read_shards(self, indexes: list[int] | None = None) -> list[tuple[JsonFileStorage, str]]:
+        """Fetch the text of every existing shard in one read_multiple_files call.
+        
+        indexes limits the read to those shards.
+        """
+        shards = self.shards if indexes is None else [self.shards[index] for index in indexes]
+        paths = [shard.path for shard in shards]
+        result = await self.call_tool("read_multiple_files", {"paths": paths})
+        contents = []
+        # The server answers with "<path>:\n<content>\n" per file, joined by
+        # "\n---\n", or "<path>: Error - ..." for files that don't exist yet.
+        for shard, path, chunk in zip(shards, paths, result.split("\n---\n")):
+            header = f"{path}:\n"
+            if chunk.startswith(header):
+                contents.append((shard, chunk[len(header):].removesuffix("\n")))
+        return contents
+    
+    async def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Rewrite only the shards touched by records, concurrently."""
+        touched: dict[int, list[dict[str, Any]]] = {}
+        for record in records:
+            touched.setdefault(self.shard_index(record_task_id(record)), []).append(record)
+        
+        writes = []
+        for index, shard_records in touched.items():
+            shard_tasks = TaskTable(task for task in tasks if self.shard_index(task["id"]) == index)
+            writes.append(self.shards[index].save(shard_tasks, shard_records))
+        await asyncio.gather(*writes)
+
+
+class SQLiteStorage(TaskStorage):
+    """Stores tasks as rows of a local SQLite database.
+    
+    The id is the primary key and priority/completed are indexed, so
+    completing or deleting a task is a single indexed row update instead of
+    a rewrite of the whole list, and listing streams rows from a cursor.
+    This backend talks to SQLite directly rather than through MCP; blocking
+    calls run in a worker thread.
+    """
+    
+    def __init__(self, path: str, batch_size: int = 500, id_block: int = 100):
+        self.path = path
+        self.batch_size = batch_size
+        self.ids = IdSequence(self._take_ids, id_block)
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+    
+    async def close(self):
+        """Close the database connection."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+    
+    async def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Fetch only the rows for task_ids when given, otherwise every row."""
+        if task_ids is None:
+            return TaskTable(await self._run(self._fetch, "SELECT * FROM tasks ORDER BY id", ()))
+        
+        rows = []
+        # batch_size ids per query keeps well under SQLite's parameter limit
+        for chunk in chunked(sorted(task_ids), self.batch_size):
+            placeholders = ", ".join("?" * len(chunk))
+            rows += await self._run(
+                self._fetch, f"SELECT * FROM tasks WHERE id IN ({placeholders}) ORDER BY id", tuple(chunk)
+            )
+        return TaskTable(rows)
+    
+    async def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Apply records as row statements in one transaction."""
+        await self._run(self._execute, records)
+    
+    async def scan(self) -> AsyncIterator[dict[str, Any]]:
+        """Stream rows in id order, batch_size rows at a time."""
+        async for task in self.select():
+            yield task
+    
+    async def select(self, priority: str | None = None, completed: bool | None = None) -> AsyncIterator[dict[str, Any]]:
+        """Stream matching rows through the priority and completed indexes."""
+        conditions, params = self._filters(priority, completed)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = await self._run(self._cursor, f"SELECT * FROM tasks{where} ORDER BY id", params)
+        while rows := await self._run(cursor.fetchmany, self.batch_size):
+            for row in rows:
+                yield self._to_task(row)
+    
+    async def page(
+        self,
+        after: int,
+        limit: int,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> list[dict[str, Any]]:
+        """Fetch one page by seeking past after on the primary key."""
+        conditions, params = self._filters(priority, completed)
+        return await self._run(
+            self._fetch,
+            f"SELECT * FROM tasks WHERE {' AND '.join(['id > ?', *conditions])} ORDER BY id LIMIT ?",
+            (after, *params, limit)
+        )
+    
+    async def next_tasks(self, k: int) -> list[dict[str, Any]]:
+        """Fetch the k most urgent open tasks, one indexed query per priority."""
+        placeholders = ", ".join("?" * len(PRIORITIES))
+        queries = [("priority = ?", (priority,)) for priority in PRIORITIES]
+        queries.append((f"priority NOT IN ({placeholders})", PRIORITIES))
+        
+        found: list[dict[str, Any]] = []
+        for condition, params in queries:
+            if len(found) >= k:
+                break
+            found += await self._run(
+                self._fetch,
+                f"SELECT * FROM tasks WHERE completed = 0 AND {condition} ORDER BY id LIMIT ?",
+                (*params, k - len(found))
+            )
+        return found
+    
+    async def stats(self) -> dict[str, Any]:
+        """Read the counts the triggers keep in task_stats."""
+        rows = await self._run(self._fetch_rows, "SELECT priority, completed, count FROM task_stats")
+        return count_stats((priority, bool(completed), count) for priority, completed, count in rows)
+    
+    async def reserve_ids(self, count: int) -> int:
+        """Reserve ids from the task_ids row, id_block at a time."""
+        return await self.ids.reserve(count)
+    
+    async def _take_ids(self, count: int) -> int:
+        """Reserve count ids from the task_ids row."""
+        return await self._run(self._advance_ids, count)
+    
+    async def _run(self, function, *args):
+        """Run a blocking database call in a worker thread, one at a time."""
+        async with self._lock:
+            return await asyncio.to_thread(function, *args)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the schema on first use."""
+        if self._connection is None:
+            # Calls are serialized by _lock but may land on different threads
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.executescript(SQLITE_SCHEMA)
+        return self._connection
+    
+    def _cursor(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Start a query and return its cursor."""
+        return self._connect().execute(query, params)
+    
+    def _fetch_rows(self, query: str, params: tuple = ()) -> list[tuple]:
+        """Run a query and return its rows as plain tuples."""
+        return [tuple(row) for row in self._cursor(query, params)]
+    
+    @staticmethod
+    def _filters(priority: str | None, completed: bool | None) -> tuple[list[str], tuple]:
+        """Build WHERE conditions and their parameters for a status filter."""
+        conditions = []
+        params: list[Any] = []
+        if priority is not None:
+            conditions.append("priority = ?")
+            params.append(priority)
+        if completed is not None:
+            conditions.append("completed = ?")
+            params.append(int(completed))
+        return conditions, tuple(params)
+    
+    def _fetch(self, query: str, params: tuple) -> list[dict[str, Any]]:
+        """Run a query and convert its rows to task dictionaries."""
+        return [self._to_task(row) for row in self._cursor(query, params)]
+    
+    def _advance_ids(self, count: int) -> int:
+        """Move the id sequence on by count and return where it was."""
+        connection = self._connect()
+        with connection:
+            # The UPDATE takes the write lock, so no other process reads the
+            # same value in between
+            connection.execute("UPDATE task_ids SET next_id = next_id + ?", (count,))
+            (next_id,) = connection.execute("SELECT next_id FROM task_ids").fetchone()
+        return next_id - count
+    
+    def _execute(self, records: list[dict[str, Any]]):
+        """Translate records to statements and commit them together."""
+        connection = self._connect()
+        with connection:
+            for record in records:
+                if record["op"] == "add":
+                    task = record["task"]
+                    params = (task["id"], task["description"], task["priority"], task["completed"])
+                else:
+                    params = (record["id"],)
+                connection.execute(SQLITE_STATEMENTS[record["op"]], params)
+    
+    @staticmethod
+    def _to_task(row: sqlite3.Row) -> dict[str, Any]:
+        """Convert a database row to the task dictionary used everywhere else."""
+        return {
+            "id": row["id"],
+            "description": row["description"],
+            "priority": row["priority"],
+            "completed": bool(row["completed"])
+        }
+
+
+class OperationLogStorage(TaskStorage):
+    """Stores tasks as an append-only log of add/complete/delete records.
+    
+    The task list is rebuilt by replaying the log once and then kept in
+    memory, so each mutation only ships its own records to the server and
+    costs the same regardless of how many tasks exist. This assumes a single
+    writer per log file.
+    
+    A background compactor periodically writes the materialized list to a
+    snapshot file and truncates the log, so a cold start reads one snapshot
+    plus a bounded tail of records. Compaction runs once at least
+    compact_min_records records are pending and either compact_max_records
+    is reached or the log holds compact_ratio records per live task.
+    
+    The "#end" line closing the log carries the task counts and is replaced
+    by every append, so stats() reads that one line instead of replaying.
+    """
+    
+    def __init__(
+        self,
+        call_tool,
+        path: str,
+        snapshot_path: str | None = None,
+        compact_interval: float = 5.0,
+        compact_min_records: int = 100,
+        compact_max_records: int = 10_000,
+        compact_ratio: float = 1.0,
+    ):
+        self.call_tool = call_tool
+        self.path = path
+        self.snapshot_path = snapshot_path or f"{path}.snapshot"
+        self.compact_interval = compact_interval
+        self.compact_min_records = compact_min_records
+        self.compact_max_records = compact_max_records
+        self.compact_ratio = compact_ratio
+        self._tasks: TaskTable | None = None
+        # Sequence number of the last logged record and of the last record
+        # folded into the snapshot. Records are numbered implicitly from the
+        # "#base" header of the log file.
+        self._seq = 0
+        self._snapshot_seq = 0
+        # The exact end line on the server, which each append replaces
+        self._end = f"{LOG_END}\n"
+        self._lock = asyncio.Lock()
+        self._compactor: asyncio.Task | None = None
+    
+    def required_tools(self) -> set[str]:
+        """Name the MCP tools this storage calls."""
+        return {"read_file", "write_file", "edit_file"}
+    
+    def keeps_tasks(self) -> bool:
+        """The replayed task list stays in memory."""
+        return True
+    
+    async def start(self):
+        """Start the background compactor."""
+        if self._compactor is None:
+            self._compactor = asyncio.create_task(self._compact_loop())
+    
+    async def close(self):
+        """Stop the background compactor."""
+        if self._compactor is not None:
+            self._compactor.cancel()
+            try:
+                await self._compactor
+            except asyncio.CancelledError:
+                pass
+            self._compactor = None
+    
+    async def load(self, task_ids: Collection[int] | None = None) -> TaskTable:
+        """Return the materialized task list, replaying the log on first use."""
+        if self._tasks is None:
+            async with self._lock:
+                if self._tasks is None:
+                    self._tasks = await self._replay()
+        return self._tasks
+    
+    async def save(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Append records above the end marker with a single edit_file call.
+        
+        If the call fails, the table in memory (which the caller has already
+        changed) is dropped, so the next load replays the log as it is.
+        """
+        async with self._lock:
+            if not records:
+                self._tasks = tasks
+                return
+            lines = "".join(dump_record(record) for record in records)
+            end = self._end_line(tasks)
+            try:
+                await self.call_tool(
+                    "edit_file",
+                    {
+                        "path": self.path,
+                        "edits": [{"oldText": self._end, "newText": lines + end}]
+                    }
+                )
+            except BaseException:
+                self.discard()
+                raise
+            self._tasks = tasks
+            self._seq += len(records)
+            self._end = end
+    
+    def discard(self):
+        """Drop the task list, so the next load replays the log."""
+        self._tasks = None
+    
+    async def stats(self) -> dict[str, Any]:
+        """Count tasks from memory, or from the log's end line before replay."""
+        if self._tasks is None:
+            try:
+                last = await self.call_tool("read_file", {"path": self.path, "tail": 1})
+            except ToolError:
+                last = ""
+            if last.startswith(f"{LOG_END} "):
+                return json.loads(last[len(LOG_END):])["stats"]
+        # Logs written before the end line held counts are replayed
+        return (await self.load()).stats()
+    
+    def needs_compaction(self) -> bool:
+        """Check the size and ratio triggers against the pending log tail."""
+        pending = self._seq - self._snapshot_seq
+        if self._tasks is None or pending < self.compact_min_records:
+            return False
+        return (
+            pending >= self.compact_max_records
+            or pending >= self.compact_ratio * len(self._tasks)
+        )
+    
+    async def compact(self):
+        """Fold every logged record into a new snapshot and truncate the log."""
+        async with self._lock:
+            # Rebuild from what is on the server rather than from memory, so
+            # a mutation applied in memory but not yet logged is never folded
+            # into the snapshot ahead of its record.
+            tasks, seq, snapshot_seq = await self._read_state()
+            if seq == snapshot_seq:
+                return
+            # The snapshot is written first: if we stop before truncating,
+            # replay skips the records it already covers.
+            snapshot = {"seq": seq, "next_id": tasks.next_id(), "tasks": list(tasks)}
+            await self.call_tool(
+                "write_file",
+                {"path": self.snapshot_path, "content": json.dumps(snapshot)}
+            )
+            end = self._end_line(tasks)
+            await self.call_tool(
+                "write_file",
+                {"path": self.path, "content": f"#base {seq}\n{end}"}
+            )
+            self._snapshot_seq = seq
+            self._end = end
+    
+    async def _compact_loop(self):
+        """Periodically compact the log while the manager is connected."""
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            if self.needs_compaction():
+                try:
+                    await self.compact()
+                except Exception as e:
+                    print(f"⚠️  Log compaction failed: {e}")
+    
+    @staticmethod
+    def _end_line(tasks: TaskTable) -> str:
+        """Render the line that closes the log, holding the task counts."""
+        return f"{LOG_END} {edit_safe(json.dumps(document_meta(tasks)))}\n"
+    
+    async def _replay(self) -> TaskTable:
+        """Rebuild the task list and remember where the log stands."""
+        tasks, self._seq, self._snapshot_seq = await self._read_state()
+        return tasks
+    
+    async def _read_state(self) -> tuple[TaskTable, int, int]:
+        """Read the snapshot and replay the log tail after it.
+        
+        Returns the tasks, the sequence number of the last logged record and
+        the sequence number covered by the snapshot.
+        """
+        tasks = TaskTable()
+        snapshot_seq = 0
+        try:
+            snapshot = json.loads(
+                await self.call_tool("read_file", {"path": self.snapshot_path})
+            )
+            tasks = TaskTable(snapshot["tasks"], snapshot.get("next_id", 1))
+            snapshot_seq = snapshot["seq"]
+        except ToolError:
+            # No snapshot yet, replay the whole log
+            pass
+        
+        try:
+            content = await self.call_tool("read_file", {"path": self.path})
+        except ToolError:
+            self._end = self._end_line(tasks)
+            await self.call_tool(
+                "write_file",
+                {"path": self.path, "content": f"#base {snapshot_seq}\n{self._end}"}
+            )
+            return tasks, snapshot_seq, snapshot_seq
+        
+        seq = 0
+        for line in content.splitlines(keepends=True):
+            if line.startswith("#base "):
+                seq = int(line.split()[1])
+            elif line.startswith(LOG_END):
+                self._end = line
+            elif line.strip() and not line.startswith("#"):
+                seq += 1
+                if seq > snapshot_seq:
+                    apply_record(tasks, json.loads(line))
+        return tasks, max(seq, snapshot_seq), snapshot_seq
+
 
 class TaskManager:
-    """A simple task manager that uses MCP servers to store tasks."""
+    """A simple task manager that uses MCP servers to store tasks.
+    
+    With write_back enabled the manager keeps the task list in memory as the
+    source of truth and collects changes instead of writing each one. They
+    are flushed in one storage write once flush_threshold records are
+    pending, flush_interval seconds after the first unflushed change, or on
+    close(). Only use it when this manager is the sole writer.
     
-    def __init__(self):
+    Changes made by concurrent coroutines are group-committed: everything
+    queued within commit_window seconds, or while the previous batch is
+    still being written, is applied to a single read and saved in a single
+    write.
+    
+    With storage="json" and versioned=True, several processes can share the
+    file: a save that loses the race raises VersionConflict and the batch is
+    retried against a fresh read. Transactions are not replayed; they raise
+    VersionConflict to the caller. This can't be combined with write_back.
+    
+    With lock=True every read-modify-write, including transactions and
+    write-back flushes, runs under a LeaseLock on the server, so workers
+    sharing the files take turns instead of racing.
+    """
+    
+    def __init__(
+        self,
+        storage: str = "json",
+        write_back: bool = False,
+        flush_interval: float = 1.0,
+        flush_threshold: int = 100,
+        commit_window: float = 0.0,
+        max_retries: int = 5,
+        retry_delay: float = 0.05,
+        lock: bool = False,
+        lock_lease: float = 10.0,
+        lock_timeout: float = 30.0,
+        tool_cache: str | Path | None = DEFAULT_TOOL_CACHE,
+        **storage_options,
+    ):
+        if write_back and storage_options.get("versioned"):
+            # A flush that loses the race can't be retried: the cache it
+            # writes from never sees the other process's changes
+            raise ValueError("write_back assumes a single writer; it can't be combined with versioned")
         self.session: ClientSession | None = None
         self.tasks_file = "tasks.json"
+        self.storage = self._create_storage(storage, storage_options)
+        self.write_back = write_back
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._cache: TaskTable | None = None
+        self._pending: list[dict[str, Any]] = []
+        self._flush_timer: asyncio.Task | None = None
+        self.commit_window = commit_window
+        self._queue: list[tuple[Any, int | None, asyncio.Future]] = []
+        self._committer: asyncio.Task | None = None
+        self._commit_lock = asyncio.Lock()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.lock = LeaseLock(
+            self._call_tool,
+            f"/tmp/{self.tasks_file}.lock",
+            lease=lock_lease,
+            timeout=lock_timeout
+        ) if lock else None
+        self.tool_cache = ToolCatalogCache(tool_cache) if tool_cache else None
+        self.tools: list[dict[str, str]] = []
+        self._tool_refresh: asyncio.Task | None = None
+    
+    def _create_storage(self, kind: str, options: dict[str, Any]) -> TaskStorage:
+        """Build the storage backend named by kind."""
+        if kind == "json":
+            return JsonFileStorage(self._call_tool, f"/tmp/{self.tasks_file}", **options)
+        if kind == "log":
+            return OperationLogStorage(self._call_tool, "/tmp/tasks.log", **options)
+        if kind == "sharded":
+            return ShardedStorage(self._call_tool, f"/tmp/{self.tasks_file}", **options)
+        if kind == "sqlite":
+            return SQLiteStorage("/tmp/tasks.db", **options)
+        raise ValueError(f"Unknown storage: {kind}")
     
     async def connect_to_server(self):
         """Connect to the filesystem MCP server."""
@@ -36,14 +1455,54 @@ class TaskManager:
         self.read, self.write = stdio_transport
         self.session = ClientSession(self.read, self.write)
         
-        await self.session.initialize()
+        initialized = await self.session.initialize()
         print("✅ Connected to MCP filesystem server")
         
         # List available tools
-        tools = await self.session.list_tools()
+        self.tools = await self._discover_tools(server_params, initialized.serverInfo)
         print(f"\n📦 Available tools from MCP server:")
-        for tool in tools.tools:
-            print(f"  - {tool.name}: {tool.description}")
+        for tool in self.tools:
+            print(f"  - {tool['name']}: {tool['description']}")
+        
+        await self.storage.start()
+    
+    async def _discover_tools(self, server_params: StdioServerParameters, server_info: Any) -> list[dict[str, str]]:
+        """Return the server's tools, from the on-disk cache when possible.
+        
+        A cached catalogue is used straight away and refreshed in the
+        background; we only wait for list_tools when there is no cache entry
+        or it lacks a tool the storage needs.
+        """
+        if self.tool_cache is None:
+            return await self._list_tools()
+        
+        key = self.tool_cache.key(server_params.command, server_params.args, server_info)
+        required = self.storage.required_tools()
+        tools = self.tool_cache.load(key)
+        if tools is not None and required <= {tool["name"] for tool in tools}:
+            self._tool_refresh = asyncio.create_task(self._refresh_tool_cache(key))
+            return tools
+        
+        tools = await self._list_tools()
+        self.tool_cache.store(key, tools)
+        missing = required - {tool["name"] for tool in tools}
+        if missing:
+            print(f"⚠️  Server is missing tools: {', '.join(sorted(missing))}")
+        return tools
+    
+    async def _list_tools(self) -> list[dict[str, str]]:
+        """Ask the server for its tools."""
+        result = await self.session.list_tools()
+        return [{"name": tool.name, "description": tool.description or ""} for tool in result.tools]
+    
+    async def _refresh_tool_cache(self, key: str):
+        """Re-list the tools in the background and update the cache."""
+        try:
+            self.tools = await self._list_tools()
+            self.tool_cache.store(key, self.tools)
+        except Exception:
+            # A stale catalogue is still usable; try again next start
+            pass
     
     async def add_task(self, task_description: str, priority: str = "medium"):
         """Add a new task using the MCP server."""
@@ -51,43 +1510,265 @@ class TaskManager:
             print("❌ Not connected to MCP server")
             return
         
-        # Read existing tasks
-        tasks = await self._read_tasks()
+        # Storages without an id counter number the task as it is saved
+        task_id = await self.storage.reserve_ids(1)
         
-        # Add new task
-        new_task = {
-            "id": len(tasks) + 1,
-            "description": task_description,
-            "priority": priority,
-            "completed": False
-        }
-        tasks.append(new_task)
+        def add(tasks):
+            new_task = {
+                "id": task_id if task_id is not None else tasks.next_id(),
+                "description": task_description,
+                "priority": priority,
+                "completed": False
+            }
+            record = {"op": "add", "task": new_task}
+            apply_record(tasks, record)
+            return new_task, [record]
         
-        # Write back using MCP server's write_file tool
-        await self._write_tasks(tasks)
+        # Persist the change through the configured storage
+        await self._mutate(add, None if task_id is None else (task_id,))
         print(f"✅ Task added: {task_description} (Priority: {priority})")
     
-    async def list_tasks(self):
-        """List all tasks using the MCP server."""
+    async def add_tasks(self, new_tasks: Iterable[str | tuple[str, str]], chunk_size: int = 1000) -> list[dict[str, Any]]:
+        """Add many tasks with one read and one write per chunk_size tasks.
+        
+        Each item is a description or a (description, priority) pair. The
+        created tasks are returned in the same order.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        added = []
+        for chunk in chunked(new_tasks, chunk_size):
+            # Ids for the whole chunk come from a single reservation
+            first_id = await self.storage.reserve_ids(len(chunk))
+            
+            def add(tasks, chunk=chunk, first_id=first_id):
+                if first_id is None:
+                    first_id = tasks.next_id()
+                created = []
+                records = []
+                for offset, item in enumerate(chunk):
+                    description, priority = (item, "medium") if isinstance(item, str) else item
+                    record = {"op": "add", "task": {
+                        "id": first_id + offset,
+                        "description": description,
+                        "priority": priority,
+                        "completed": False
+                    }}
+                    created.append(apply_record(tasks, record))
+                    records.append(record)
+                return created, records
+            
+            task_ids = None if first_id is None else range(first_id, first_id + len(chunk))
+            added.extend(await self._mutate(add, task_ids))
+        print(f"✅ Added {len(added)} tasks")
+        return added
+    
+    async def list_tasks(self, priority: str | None = None, completed: bool | None = None):
+        """List tasks using the MCP server, optionally filtered."""
         if not self.session:
             print("❌ Not connected to MCP server")
             return
         
-        tasks = await self._read_tasks()
+        # Tasks are streamed so large lists are never held in memory at once
+        found = False
+        async for task in self.iter_tasks(priority, completed):
+            if not found:
+                print("\n📋 Your Tasks:")
+                print("-" * 60)
+                found = True
+            self._print_task(task)
         
-        if not tasks:
+        if not found:
             print("📝 No tasks found!")
             return
+        print("-" * 60)
+    
+    async def list_page(
+        self,
+        cursor: str | None = None,
+        limit: int = 20,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> dict[str, Any]:
+        """Print and return one page of tasks in id order.
+        
+        Returns {"tasks": [...], "next_cursor": ...}; pass next_cursor back
+        to get the following page, until it is None. A cursor remembers
+        only the last id it returned, so it stays valid while tasks are
+        added and deleted: new tasks show up on later pages and nothing
+        is skipped or repeated.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return {"tasks": [], "next_cursor": None}
+        
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        after = decode_cursor(cursor)
+        # One extra task tells us whether there is a next page
+        if self.write_back:
+            tasks = (await self._read_tasks()).page(after, limit + 1, priority, completed)
+        else:
+            tasks = await self.storage.page(after, limit + 1, priority, completed)
+        next_cursor = encode_cursor(tasks[limit - 1]["id"]) if len(tasks) > limit else None
+        tasks = tasks[:limit]
+        
+        if not tasks:
+            print("📝 No tasks found!")
+        else:
+            print("\n📋 Your Tasks:")
+            print("-" * 60)
+            for task in tasks:
+                self._print_task(task)
+            print("-" * 60)
+            if next_cursor:
+                print("➡️  More tasks on the next page")
+        return {"tasks": tasks, "next_cursor": next_cursor}
+    
+    async def next_tasks(self, k: int = 5) -> list[dict[str, Any]]:
+        """Print and return the k open tasks to work on next.
         
-        print("\n📋 Your Tasks:")
+        Tasks are ordered by priority, then oldest first. A table kept
+        between calls answers from a heap kept alongside it, SQLite from
+        indexed queries, and other storages from one pass that holds only k
+        tasks, so polling for work never sorts the whole list.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        if self.write_back:
+            upcoming = (await self._read_tasks()).next_tasks(k)
+        else:
+            upcoming = await self.storage.next_tasks(k)
+        if not upcoming:
+            print("🎉 Nothing left to do!")
+            return []
+        print("\n🎯 Next up:")
         print("-" * 60)
-        for task in tasks:
-            status = "✅" if task["completed"] else "⬜"
-            priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(
-                task["priority"], "⚪"
-            )
-            print(f"{status} [{task['id']}] {priority_emoji} {task['description']}")
+        for task in upcoming:
+            self._print_task(task)
         print("-" * 60)
+        return upcoming
+    
+    async def stats(self) -> dict[str, Any]:
+        """Print and return task counts by status and priority.
+        
+        The log and SQLite storages, and JSON documents with metadata, keep
+        the counts up to date on every change and stored next to the tasks,
+        so this never reads the tasks themselves. Otherwise they are counted
+        in one pass as the tasks stream past.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return {}
+        
+        if self.write_back:
+            stats = (await self._read_tasks()).stats()
+        else:
+            stats = await self.storage.stats()
+        print(f"\n📊 {stats['total']} tasks: {stats['open']} open, {stats['completed']} completed")
+        for priority, group in stats["by_priority"].items():
+            print(f"   {priority}: {group['open']} open, {group['completed']} completed")
+        return stats
+    
+    async def search_tasks(self, query: str, limit: int | None = 20) -> list[dict[str, Any]]:
+        """Print and return the tasks whose descriptions match query, best first.
+        
+        Words must all appear, "OR" separates alternatives and "word*"
+        matches by prefix. Ranking goes through the table's inverted index
+        when the table is kept between calls (write_back, cache_reads or the
+        log storage), and through a single scan of the tasks otherwise.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        if self._keeps_tasks():
+            matches = (await self._read_tasks()).search(query, limit)
+        else:
+            search = SearchScan(query)
+            async for task in self.storage.scan():
+                search.add(task)
+            matches = search.results(limit)
+        if not matches:
+            print(f"🔍 No tasks match '{query}'")
+            return []
+        print(f"\n🔍 Tasks matching '{query}':")
+        print("-" * 60)
+        for task in matches:
+            self._print_task(task)
+        print("-" * 60)
+        return matches
+    
+    async def fuzzy_search_tasks(
+        self,
+        query: str,
+        limit: int | None = 20,
+        threshold: float = 0.5
+    ) -> list[dict[str, Any]]:
+        """Print and return the tasks whose descriptions roughly contain query.
+        
+        Matches misspellings and parts of words: a task qualifies when it has
+        at least threshold of the query's trigrams, and tasks with more of
+        them come first. Like search_tasks, this uses the table's trigram
+        index when the table is kept between calls and a scan otherwise.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        if self._keeps_tasks():
+            matches = (await self._read_tasks()).fuzzy_search(query, limit, threshold)
+        else:
+            search = FuzzyScan(query, limit, threshold)
+            async for task in self.storage.scan():
+                search.add(task)
+            matches = search.results()
+        if not matches:
+            print(f"🔍 Nothing close to '{query}'")
+            return []
+        print(f"\n🔍 Tasks like '{query}':")
+        print("-" * 60)
+        for task in matches:
+            self._print_task(task)
+        print("-" * 60)
+        return matches
+    
+    @staticmethod
+    def _print_task(task: dict[str, Any]):
+        """Print one task as a line of a listing."""
+        status = "✅" if task["completed"] else "⬜"
+        priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(
+            task["priority"], "⚪"
+        )
+        print(f"{status} [{task['id']}] {priority_emoji} {task['description']}")
+    
+    async def iter_tasks(self, priority: str | None = None, completed: bool | None = None) -> AsyncIterator[dict[str, Any]]:
+        """Yield tasks one at a time, parsing them as they are read.
+        
+        Filtering by priority or completed goes through an index where one
+        is kept (SQLite, or a table kept between calls), so it only touches
+        the matching tasks; other storages filter as the tasks stream past.
+        """
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return
+        
+        if self.write_back:
+            # The cache may hold changes the storage hasn't seen yet
+            for task in (await self._read_tasks()).select(priority, completed):
+                yield task
+            return
+        
+        if priority is None and completed is None:
+            async for task in self.storage.scan():
+                yield task
+        else:
+            async for task in self.storage.select(priority, completed):
+                yield task
     
     async def complete_task(self, task_id: int):
         """Mark a task as complete using the MCP server."""
@@ -95,49 +1776,301 @@ class TaskManager:
             print("❌ Not connected to MCP server")
             return
         
-        tasks = await self._read_tasks()
+        def complete(tasks):
+            record = {"op": "complete", "id": task_id}
+            if apply_record(tasks, record) is None:
+                return False, []
+            return True, [record]
         
-        for task in tasks:
-            if task["id"] == task_id:
-                task["completed"] = True
-                await self._write_tasks(tasks)
-                print(f"✅ Task {task_id} marked as complete!")
+        if not await self._mutate(complete, (task_id,)):
+            print(f"❌ Task {task_id} not found")
+            return
+        print(f"✅ Task {task_id} marked as complete!")
+    
+    async def delete_task(self, task_id: int):
+        """Delete a task using the MCP server."""
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return
+        
+        def delete(tasks):
+            record = {"op": "delete", "id": task_id}
+            if apply_record(tasks, record) is None:
+                return False, []
+            return True, [record]
+        
+        if not await self._mutate(delete, (task_id,)):
+            print(f"❌ Task {task_id} not found")
+            return
+        print(f"🗑️  Task {task_id} deleted!")
+    
+    async def complete_tasks(self, task_ids: Iterable[int], chunk_size: int = 1000) -> list[bool]:
+        """Complete many tasks, returning whether each id was found."""
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        found = await self._apply_to_ids("complete", task_ids, chunk_size)
+        print(f"✅ Completed {sum(found)} of {len(found)} tasks")
+        return found
+    
+    async def delete_tasks(self, task_ids: Iterable[int], chunk_size: int = 1000) -> list[bool]:
+        """Delete many tasks, returning whether each id was found."""
+        if not self.session:
+            print("❌ Not connected to MCP server")
+            return []
+        
+        found = await self._apply_to_ids("delete", task_ids, chunk_size)
+        print(f"🗑️  Deleted {sum(found)} of {len(found)} tasks")
+        return found
+    
+    async def _apply_to_ids(self, op: str, task_ids: Iterable[int], chunk_size: int) -> list[bool]:
+        """Apply op to every id with one read and one write per chunk."""
+        found = []
+        for chunk in chunked(task_ids, chunk_size):
+            def change(tasks, chunk=chunk):
+                results = []
+                records = []
+                for task_id in chunk:
+                    record = {"op": op, "id": task_id}
+                    results.append(apply_record(tasks, record) is not None)
+                    if results[-1]:
+                        records.append(record)
+                return results, records
+            
+            found.extend(await self._mutate(change, chunk))
+        return found
+    
+    async def _call_tool(self, name: str, arguments: dict[str, Any]) -> str:
+        """Call an MCP tool and return its text, raising ToolError on failure."""
+        result = await self.session.call_tool(name, arguments=arguments)
+        text = result.content[0].text if result.content else ""
+        if result.isError:
+            raise ToolError(f"{name} failed: {text}")
+        return text
+    
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Transaction]:
+        """Read the tasks once, stage changes, and save them in one write.
+        
+        Changes are dropped if the block raises. Other changes through this
+        manager wait until the transaction ends, so inside the block use the
+        transaction's add/complete/delete rather than the manager's.
+        """
+        if not self.session:
+            raise RuntimeError("Not connected to MCP server")
+        
+        async with self._commit_lock, self._lease():
+            tx = Transaction(await self._read_tasks())
+            yield tx
+            if tx.added:
+                first_id = await self.storage.reserve_ids(len(tx.added))
+                if first_id is not None:
+                    tx.renumber(first_id)
+            if tx.records:
+                await self._write_tasks(tx.tasks, tx.records)
+        print(f"✅ Transaction committed ({len(tx.records)} changes)")
+    
+    async def _mutate(self, mutation, task_ids: Collection[int] | None = None) -> Any:
+        """Queue a change and wait until it has been committed.
+        
+        mutation is called with the current task list and returns its result
+        and the records it applied; task_ids, if known, lets the batch read
+        only the part of storage that holds those tasks.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((mutation, task_ids, future))
+        if self._committer is None or self._committer.done():
+            self._committer = asyncio.create_task(self._commit_loop())
+        return await future
+    
+    async def _commit_loop(self):
+        """Commit queued changes batch by batch until none are left."""
+        while self._queue:
+            await asyncio.sleep(self.commit_window)
+            async with self._commit_lock:
+                batch, self._queue = self._queue, []
+                try:
+                    async with self._lease():
+                        await self._commit(batch)
+                except Exception as e:
+                    # Taking or giving up the lease failed
+                    self._fail([future for _, _, future in batch], e)
+    
+    async def _commit(self, batch: list[tuple[Any, Collection[int] | None, asyncio.Future]]):
+        """Apply a batch of changes to one read and save them with one write.
+        
+        When a versioned storage reports that another process saved first,
+        the tasks are read again and the batch re-applied, up to max_retries
+        times with a growing random delay. A change that raises fails only
+        its own caller; the rest of the batch is re-applied to a fresh read so
+        nothing it did halfway is saved. With write_back the cached table is
+        the only copy, so there is no fresh read to fall back on.
+        """
+        # Read only the tasks the batch touches, unless some change needs them all
+        task_ids: set[int] | None = set()
+        for _, ids, _ in batch:
+            if ids is None:
+                task_ids = None
+                break
+            task_ids.update(ids)
+        attempt = 0
+        while True:
+            try:
+                tasks = await self._read_tasks(task_ids, for_update=True)
+            except Exception as e:
+                self._fail([future for _, _, future in batch], e)
+                return
+            
+            records = []
+            applied = []
+            failed = False
+            for mutation, _, future in batch:
+                if future.done():
+                    continue
+                try:
+                    result, mutation_records = mutation(tasks)
+                except Exception as e:
+                    self._fail([future], e)
+                    failed = True
+                    if self.write_back:
+                        continue
+                    break
+                records.extend(mutation_records)
+                applied.append((future, result))
+            if failed and not self.write_back:
+                # The change that raised may have left part of itself in tasks
+                self.storage.discard()
+                continue
+            
+            try:
+                if records:
+                    await self._write_tasks(tasks, records)
+            except VersionConflict as e:
+                if attempt < self.max_retries:
+                    await asyncio.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+                    attempt += 1
+                    continue
+                self._fail([future for future, _ in applied], e)
                 return
+            except Exception as e:
+                self._fail([future for future, _ in applied], e)
+                return
+            for future, result in applied:
+                if not future.done():
+                    future.set_result(result)
+            return
+    
+    def _lease(self):
+        """Return the cross-process lock, or a no-op when locking is off."""
+        return self.lock if self.lock is not None else nullcontext()
+    
+    @staticmethod
+    def _fail(futures: list[asyncio.Future], error: Exception):
+        """Raise error in every caller still waiting on one of futures."""
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+    
+    def _keeps_tasks(self) -> bool:
+        """Check whether _read_tasks returns the same table until it changes."""
+        return self.write_back or self.storage.keeps_tasks()
+    
+    async def _read_tasks(self, task_ids: Collection[int] | None = None, for_update: bool = False) -> TaskTable:
+        """Read tasks through the configured storage.
+        
+        Passing task_ids lets storages that can locate tasks (such as the
+        sharded and SQLite ones) read only the shards or rows that hold them.
+        for_update tells the storage the table is about to be changed in place.
+        """
+        if not self.write_back:
+            if for_update:
+                return await self.storage.load_for_update(task_ids)
+            return await self.storage.load(task_ids)
+        if self._cache is None:
+            self._cache = await self.storage.load()
+        return self._cache
+    
+    async def _write_tasks(self, tasks: TaskTable, records: list[dict[str, Any]]):
+        """Persist tasks and the records describing what changed."""
+        if not self.write_back:
+            try:
+                if self.lock is not None:
+                    # Writing after our lease ran out could overwrite the next holder
+                    self.lock.check()
+                await self.storage.save(tasks, records)
+            except BaseException:
+                # tasks was changed in place; no copy of it may outlive the failed write
+                self.storage.discard()
+                raise
+            return
+        
+        self._cache = tasks
+        self._pending.extend(records)
+        if len(self._pending) >= self.flush_threshold:
+            # We are inside a commit or transaction, which holds the lease
+            await self._flush_pending()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+    
+    async def flush(self):
+        """Write every pending change to storage in one save.
         
-        print(f"❌ Task {task_id} not found")
+        The save waits for any commit in progress and runs under the lease,
+        like every other write.
+        """
+        self._stop_flush_timer()
+        if not self._pending:
+            return
+        async with self._commit_lock, self._lease():
+            await self._flush_pending()
     
-    async def _read_tasks(self) -> list[dict[str, Any]]:
-        """Read tasks from file using MCP server."""
+    async def _flush_pending(self):
+        """Save the pending changes; the caller holds _commit_lock and the lease."""
+        self._stop_flush_timer()
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
         try:
-            # Use MCP server's read_file tool
-            result = await self.session.call_tool(
-                "read_file",
-                arguments={"path": f"/tmp/{self.tasks_file}"}
-            )
-            
-            # Parse the content from MCP response
-            content = result.content[0].text if result.content else "[]"
-            return json.loads(content)
-        except Exception:
-            # File doesn't exist yet, return empty list
-            return []
+            if self.lock is not None:
+                self.lock.check()
+            await self.storage.save(self._cache, records)
+        except BaseException:
+            # Keep the changes so the next flush retries them
+            self._pending[:0] = records
+            raise
     
-    async def _write_tasks(self, tasks: list[dict[str, Any]]):
-        """Write tasks to file using MCP server."""
-        # Use MCP server's write_file tool
-        await self.session.call_tool(
-            "write_file",
-            arguments={
-                "path": f"/tmp/{self.tasks_file}",
-                "content": json.dumps(tasks, indent=2)
-            }
-        )
+    def _stop_flush_timer(self):
+        """Cancel a scheduled flush that hasn't started yet."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+    
+    async def _flush_later(self):
+        """Flush once flush_interval has passed since the first pending change."""
+        await asyncio.sleep(self.flush_interval)
+        # Once flushing starts it must not be cancelled halfway
+        self._flush_timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"⚠️  Background flush failed: {e}")
     
     async def close(self):
         """Close the connection to the MCP server."""
         if self.session:
-            await self.session.close()
-            print("\n👋 Disconnected from MCP server")
+            if self._tool_refresh is not None and not self._tool_refresh.done():
+                self._tool_refresh.cancel()
+            try:
+                # Unsaved changes are lost if this fails, but the connection
+                # and background work must still be shut down
+                await self.flush()
+            finally:
+                try:
+                    await self.storage.close()
+                finally:
+                    await self.session.close()
+                    print("\n👋 Disconnected from MCP server")
 
 
 async def main():
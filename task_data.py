@@ -0,0 +1,969 @@
+"""
+Task data helpers shared by both task managers.
+
+The simulated demo and the real MCP client store the same task dictionaries.
+This module holds the pieces that don't care which server is on the other
+end, starting with how a task list is turned into file text and back.
+"""
+
+import base64
+import binascii
+import bisect
+import heapq
+import json
+import math
+import re
+from collections import Counter
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator
+
+
+# "array" is the original pretty-printed JSON array; "ndjson" writes one
+# compact task per line so new tasks can be appended and lines streamed.
+FORMATS = ("array", "ndjson")
+
+# Versioned files start with this line so writers can detect that someone
+# else saved the file since they read it.
+VERSION_PREFIX = "#version "
+
+# Documents saved with metadata end with this line, holding counts that
+# describe the tasks above it, so they can be read without parsing any task.
+# It makes an array document invalid JSON, so it is only written on request.
+META_PREFIX = "#meta "
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_WORD = re.compile(r"\w+")
+_NON_WORD = re.compile(r"\W+")
+
+# Priorities from most to least urgent; anything else sorts after them
+PRIORITIES = ("high", "medium", "low")
+_PRIORITY_RANK = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+# BM25 parameters used to rank search results
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+# Schema and row statements for storing tasks in SQLite, used by the real
+# storage and the simulated SQLite server alike.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_priority ON tasks (priority);
+CREATE INDEX IF NOT EXISTS tasks_completed ON tasks (completed);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (priority, completed, id);
+
+-- Task counts per (priority, completed), kept current by triggers so stats
+-- never scan the table. The INSERT fills it in for databases made before it.
+CREATE TABLE IF NOT EXISTS task_stats (
+    priority TEXT NOT NULL,
+    completed INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (priority, completed)
+);
+INSERT INTO task_stats
+    SELECT priority, completed, COUNT(*) FROM tasks
+    WHERE NOT EXISTS (SELECT 1 FROM task_stats)
+    GROUP BY priority, completed;
+CREATE TRIGGER IF NOT EXISTS tasks_count_insert AFTER INSERT ON tasks BEGIN
+    INSERT INTO task_stats VALUES (NEW.priority, NEW.completed, 1)
+        ON CONFLICT (priority, completed) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_count_delete AFTER DELETE ON tasks BEGIN
+    UPDATE task_stats SET count = count - 1
+        WHERE priority = OLD.priority AND completed = OLD.completed;
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_count_update AFTER UPDATE OF priority, completed ON tasks BEGIN
+    UPDATE task_stats SET count = count - 1
+        WHERE priority = OLD.priority AND completed = OLD.completed;
+    INSERT INTO task_stats VALUES (NEW.priority, NEW.completed, 1)
+        ON CONFLICT (priority, completed) DO UPDATE SET count = count + 1;
+END;
+
+-- The next unused task id. It only ever grows, so ids are not reused after
+-- a delete; existing databases start just past their highest id.
+CREATE TABLE IF NOT EXISTS task_ids (
+    only INTEGER PRIMARY KEY CHECK (only = 0),
+    next_id INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO task_ids SELECT 0, COALESCE(MAX(id), 0) + 1 FROM tasks;
+"""
+
+SQLITE_STATEMENTS = {
+    "add": "INSERT INTO tasks (id, description, priority, completed) VALUES (?, ?, ?, ?)",
+    "complete": "UPDATE tasks SET completed = 1 WHERE id = ?",
+    "delete": "DELETE FROM tasks WHERE id = ?",
+}
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """Split items into lists of at most size, without reading ahead."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def split_version(content: str) -> tuple[int, str]:
+    """Split the version header off task text, returning (version, body).
+    
+    Text without a header is version 0.
+    """
+    if not content.startswith(VERSION_PREFIX):
+        return 0, content
+    header, _, body = content.partition("\n")
+    return int(header[len(VERSION_PREFIX):]), body
+
+
+def _body_start(content: str) -> int:
+    """Return where the tasks begin, after any version header."""
+    if content.startswith(VERSION_PREFIX):
+        return content.find("\n") + 1 or len(content)
+    return 0
+
+
+def _body_end(content: str) -> int:
+    """Return where the tasks end, before any metadata trailer."""
+    start = content.rfind("\n", 0, len(content) - 1) + 1
+    if content.startswith(META_PREFIX, start):
+        return start
+    return len(content)
+
+
+def split_document(content: str) -> tuple[str, str, str]:
+    """Split task text into its version header, tasks and metadata trailer.
+    
+    Missing parts come back empty, and the three always add up to content.
+    """
+    start, end = _body_start(content), _body_end(content)
+    return content[:start], content[start:end], content[end:]
+
+
+def read_meta(content: str) -> dict[str, Any] | None:
+    """Parse the metadata trailer at the end of task text, if it has one.
+    
+    Any tail of the text that includes the whole last line will do, so the
+    trailer can be fetched without reading the tasks.
+    """
+    end = _body_end(content)
+    if end == len(content):
+        return None
+    return json.loads(content[end + len(META_PREFIX):])
+
+
+def detect_format(content: str) -> str | None:
+    """Guess the format of stored task text, or None if it is empty."""
+    stripped = content[_body_start(content):_body_end(content)].lstrip()
+    if not stripped:
+        return None
+    return "array" if stripped.startswith("[") else "ndjson"
+
+
+def encode_tasks(tasks: Iterable[dict[str, Any]], format: str = "array") -> str:
+    """Render a task list as file text in the given format."""
+    if format == "array":
+        return json.dumps(list(tasks), indent=2)
+    if format == "ndjson":
+        return "".join(json.dumps(task) + "\n" for task in tasks)
+    raise ValueError(f"Unknown format: {format}")
+
+
+def decode_tasks(content: str) -> list[dict[str, Any]]:
+    """Parse task text in either format.
+    
+    The format is detected from the content, so a file written as an array
+    keeps loading after switching to NDJSON until it is next rewritten.
+    """
+    format = detect_format(content)
+    if format is None:
+        return []
+    content = split_document(content)[1]
+    if format == "array":
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def iter_decode_tasks(content: str) -> Iterator[dict[str, Any]]:
+    """Parse task text one task at a time.
+    
+    Unlike decode_tasks this never builds the whole list: NDJSON is walked
+    line by line and arrays element by element with JSONDecoder.raw_decode,
+    so only the text and the current task are held in memory.
+    """
+    format = detect_format(content)
+    if format is None:
+        return
+    
+    if format == "ndjson":
+        start, body_end = _body_start(content), _body_end(content)
+        while start < body_end:
+            end = content.find("\n", start)
+            if end == -1:
+                end = len(content)
+            if content[start:end].strip():
+                yield json.loads(content[start:end])
+            start = end + 1
+        return
+    
+    # Skip the opening bracket, then alternate between values and separators
+    index = _WHITESPACE.match(content, _body_start(content)).end() + 1
+    index = _WHITESPACE.match(content, index).end()
+    if content.startswith("]", index):
+        return
+    while True:
+        task, index = _DECODER.raw_decode(content, index)
+        yield task
+        index = _WHITESPACE.match(content, index).end()
+        if content.startswith(",", index):
+            index = _WHITESPACE.match(content, index + 1).end()
+        elif content.startswith("]", index):
+            return
+        else:
+            raise ValueError(f"Malformed task array at position {index}")
+
+
+def matches_status(task: dict[str, Any], priority: str | None = None, completed: bool | None = None) -> bool:
+    """Check a task against a priority and/or completion filter; None matches anything."""
+    return priority in (None, task["priority"]) and completed in (None, task["completed"])
+
+
+class StatusIndex:
+    """Task ids grouped by (priority, completed), each group kept sorted.
+    
+    New ids are the highest yet, so adding a task is usually an append.
+    Sorted groups let ids() start after any id with a binary search, which
+    is what makes a page of results cost as much as the page.
+    """
+    
+    # Completing a task moves it between groups.
+    tracks_status = True
+    
+    def __init__(self, tasks: Iterable[dict[str, Any]]):
+        self.groups: dict[tuple[str, bool], list[int]] = {}
+        for task in tasks:
+            self.add(task)
+    
+    def add(self, task: dict[str, Any]):
+        ids = self.groups.setdefault((task["priority"], task["completed"]), [])
+        if ids and ids[-1] > task["id"]:
+            bisect.insort(ids, task["id"])
+        else:
+            ids.append(task["id"])
+    
+    def remove(self, task: dict[str, Any]):
+        ids = self.groups.get((task["priority"], task["completed"]), [])
+        position = bisect.bisect_left(ids, task["id"])
+        if position < len(ids) and ids[position] == task["id"]:
+            del ids[position]
+    
+    def ids(self, priority: str | None = None, completed: bool | None = None, after: int = 0) -> Iterator[int]:
+        """Yield matching ids greater than after, in ascending order."""
+        matching = [
+            _iter_from(ids, bisect.bisect_right(ids, after))
+            for (group_priority, group_completed), ids in self.groups.items()
+            if priority in (None, group_priority) and completed in (None, group_completed)
+        ]
+        return heapq.merge(*matching)
+
+
+def _iter_from(items: list[Any], start: int) -> Iterator[Any]:
+    """Yield items[start:] without copying the list or stepping over the head."""
+    while start < len(items):
+        yield items[start]
+        start += 1
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words."""
+    return _WORD.findall(text.lower())
+
+
+def parse_query(query: str) -> list[list[str]]:
+    """Parse a search query into OR-ed groups of AND-ed terms.
+    
+    Words are AND-ed, "OR" separates alternatives, and a trailing "*" makes
+    a word match any word starting with it: "fix bug OR doc*" becomes
+    [["fix", "bug"], ["doc*"]].
+    """
+    groups: list[list[str]] = [[]]
+    for word in query.split():
+        if word == "OR":
+            groups.append([])
+        elif word != "AND":
+            terms = tokenize(word)
+            if terms and word.endswith("*"):
+                terms[-1] += "*"
+            groups[-1].extend(terms)
+    return [group for group in groups if group]
+
+
+class TextIndex:
+    """An inverted index from description words to task ids.
+    
+    Each word maps to the tasks containing it and how often it occurs in
+    each. The vocabulary is also kept sorted, so a prefix finds every word
+    it covers with a binary search.
+    """
+    
+    # Only descriptions are indexed, so completing a task changes nothing.
+    tracks_status = False
+    
+    def __init__(self, tasks: Iterable[dict[str, Any]]):
+        self.postings: dict[str, dict[int, int]] = {}
+        self.lengths: dict[int, int] = {}
+        self.total_length = 0
+        for task in tasks:
+            self._add_words(task)
+        self.vocabulary = sorted(self.postings)
+    
+    def add(self, task: dict[str, Any]):
+        for word in self._add_words(task):
+            bisect.insort(self.vocabulary, word)
+    
+    def remove(self, task: dict[str, Any]):
+        task_id = task["id"]
+        if task_id not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(task_id)
+        for word in set(tokenize(task["description"])):
+            postings = self.postings[word]
+            del postings[task_id]
+            if not postings:
+                del self.postings[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+    
+    def search(self, query: str, limit: int | None = None) -> list[tuple[int, float]]:
+        """Return (id, score) pairs for tasks matching query, best first.
+        
+        Tasks are scored with BM25 over the matched words; a task matching
+        several OR-ed groups keeps its best score. Ties go to the lower id.
+        """
+        scores: dict[int, float] = {}
+        for group in parse_query(query):
+            matches = [self._matches(term) for term in group]
+            matches.sort(key=len)
+            candidates = [
+                task_id for task_id in matches[0]
+                if all(task_id in postings for postings in matches[1:])
+            ]
+            for task_id in candidates:
+                score = sum(self._score(task_id, postings) for postings in matches)
+                scores[task_id] = max(scores.get(task_id, 0.0), score)
+        
+        def rank(item):
+            return -item[1], item[0]
+        if limit is None:
+            return sorted(scores.items(), key=rank)
+        return heapq.nsmallest(limit, scores.items(), key=rank)
+    
+    def _add_words(self, task: dict[str, Any]) -> list[str]:
+        """Index the words of one task and return the ones that are new."""
+        words = tokenize(task["description"])
+        self.lengths[task["id"]] = len(words)
+        self.total_length += len(words)
+        new_words = []
+        for word, count in Counter(words).items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                new_words.append(word)
+            self.postings[word][task["id"]] = count
+        return new_words
+    
+    def _matches(self, term: str) -> dict[int, int]:
+        """Return {id: occurrences} for a word, or for every word a prefix covers."""
+        if not term.endswith("*"):
+            return self.postings.get(term, {})
+        prefix = term[:-1]
+        merged: dict[int, int] = {}
+        index = bisect.bisect_left(self.vocabulary, prefix)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(prefix):
+            for task_id, count in self.postings[self.vocabulary[index]].items():
+                merged[task_id] = merged.get(task_id, 0) + count
+            index += 1
+        return merged
+    
+    def _score(self, task_id: int, postings: dict[int, int]) -> float:
+        """BM25 contribution of one matched term to a task's score."""
+        return _bm25(
+            postings[task_id], self.lengths[task_id], len(postings), len(self.lengths), self.total_length
+        )
+
+
+def _bm25(frequency: int, length: int, matching: int, count: int, total_length: int) -> float:
+    """BM25 contribution of a term occurring frequency times in a task of length words.
+    
+    matching is how many of the count tasks contain the term, and
+    total_length the number of words in all of them.
+    """
+    idf = math.log(1 + (count - matching + 0.5) / (matching + 0.5))
+    average = total_length / count if count else 1
+    norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * length / (average or 1))
+    return idf * frequency * (_BM25_K1 + 1) / (frequency + norm)
+
+
+class SearchScan:
+    """Ranks tasks streamed past it against a query, without an index.
+    
+    Gives the same results as TextIndex.search, for one-off searches over
+    tasks that are read for the occasion: building the index would cost
+    more than the search. Only matching tasks are kept, with the counts
+    their scores need.
+    """
+    
+    def __init__(self, query: str):
+        self.groups = parse_query(query)
+        self.terms = {term for group in self.groups for term in group}
+        self.matching: Counter[str] = Counter()
+        self.count = 0
+        self.total_length = 0
+        self.matches: list[tuple[dict[str, Any], int, dict[str, int]]] = []
+    
+    def add(self, task: dict[str, Any]):
+        words = tokenize(task["description"])
+        self.count += 1
+        self.total_length += len(words)
+        occurrences = Counter(words)
+        found = {}
+        for term in self.terms:
+            if term.endswith("*"):
+                frequency = sum(n for word, n in occurrences.items() if word.startswith(term[:-1]))
+            else:
+                frequency = occurrences[term]
+            if frequency:
+                found[term] = frequency
+                self.matching[term] += 1
+        if any(all(term in found for term in group) for group in self.groups):
+            self.matches.append((task, len(words), found))
+    
+    def results(self, limit: int | None = None) -> list[dict[str, Any]]:
+        """Return the matching tasks, best first; ties go to the lower id."""
+        # Terms are added up rarest first, in the same order as TextIndex
+        groups = [sorted(group, key=self.matching.__getitem__) for group in self.groups]
+        scored = []
+        for task, length, found in self.matches:
+            score = max(
+                sum(
+                    _bm25(found[term], length, self.matching[term], self.count, self.total_length)
+                    for term in group
+                )
+                for group in groups
+                if all(term in found for term in group)
+            )
+            scored.append((-score, task["id"], task))
+        
+        def rank(item):
+            return item[:2]
+        if limit is None:
+            ranked = sorted(scored, key=rank)
+        else:
+            ranked = heapq.nsmallest(limit, scored, key=rank)
+        return [task for _, _, task in ranked]
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the trigrams of each word, padded so word starts and ends count."""
+    grams = set()
+    for word in tokenize(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def query_trigrams(query: str) -> set[str]:
+    """Return the trigrams to look up for query.
+    
+    Words are padded at the start but not the end, so a query word matches
+    fully as the start of a longer word and mostly as its middle.
+    """
+    grams = set()
+    for word in tokenize(query):
+        padded = f"  {word}"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """An inverted index from description trigrams to task ids.
+    
+    A task matches a query when its description contains at least threshold
+    of the query's trigrams, so misspelt words and pieces of words are found
+    without scanning every description.
+    """
+    
+    tracks_status = False
+    
+    def __init__(self, tasks: Iterable[dict[str, Any]]):
+        self.postings: dict[str, set[int]] = {}
+        self.sizes: dict[int, int] = {}
+        for task in tasks:
+            self.add(task)
+    
+    def add(self, task: dict[str, Any]):
+        grams = trigrams(task["description"])
+        self.sizes[task["id"]] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(task["id"])
+    
+    def remove(self, task: dict[str, Any]):
+        if self.sizes.pop(task["id"], None) is None:
+            return
+        for gram in trigrams(task["description"]):
+            postings = self.postings[gram]
+            postings.discard(task["id"])
+            if not postings:
+                del self.postings[gram]
+    
+    def search(self, query: str, limit: int | None = None, threshold: float = 0.5) -> list[tuple[int, float]]:
+        """Return (id, score) pairs for tasks similar to query, best first.
+        
+        The score is the share of the query's trigrams found in the task, so
+        1.0 means every piece of the query appears. Ties go to the shorter
+        description, then the lower id.
+        """
+        grams = query_trigrams(query)
+        if not grams:
+            return []
+        minimum = max(1, math.ceil(threshold * len(grams)))
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        
+        # A task sharing k of the n trigrams is in at least one of the n - k + 1
+        # rarest ones. Walk them rarest first; once enough tasks share all
+        # trigrams not yet walked, nothing unseen can rank above them.
+        shared_counts: dict[int, int] = {}
+        checked: set[int] = set()
+        for walked, ids in enumerate(postings[:len(grams) - minimum + 1]):
+            for task_id in ids - checked:
+                checked.add(task_id)
+                shared = sum(task_id in other for other in postings)
+                if shared >= minimum:
+                    shared_counts[task_id] = shared
+            complete = len(grams) - walked
+            if limit is not None and sum(shared >= complete for shared in shared_counts.values()) >= limit:
+                break
+        
+        scores = {task_id: shared / len(grams) for task_id, shared in shared_counts.items()}
+        
+        def rank(item):
+            return -item[1], self.sizes[item[0]], item[0]
+        if limit is None:
+            return sorted(scores.items(), key=rank)
+        return heapq.nsmallest(limit, scores.items(), key=rank)
+
+
+class FuzzyScan:
+    """Finds tasks similar to a query as they stream past, without an index.
+    
+    Gives the same results as TrigramIndex.search, for one-off searches over
+    tasks that are read for the occasion. With a limit, only the best limit
+    matches so far are held, in a heap whose top is the weakest.
+    
+    Descriptions are never split into trigrams unless they match. A task
+    sharing minimum of the query's n trigrams has one of any n - minimum + 1
+    of them, so a single regex search for that many trigrams from inside
+    words rules most tasks out. The rest are padded the way trigrams() pads
+    words and each query trigram is looked up as a substring.
+    """
+    
+    def __init__(self, query: str, limit: int | None = None, threshold: float = 0.5):
+        self.grams = query_trigrams(query)
+        self.minimum = max(1, math.ceil(threshold * len(self.grams)))
+        self.limit = limit
+        self.matches: list[tuple[float, int, int, dict[str, Any]]] = []
+        inner = sorted(gram for gram in self.grams if " " not in gram)
+        needed = len(self.grams) - self.minimum + 1
+        self.prefilter = re.compile("|".join(map(re.escape, inner[:needed]))) if len(inner) >= needed else None
+    
+    def add(self, task: dict[str, Any]):
+        if not self.grams:
+            return
+        description = task["description"].lower()
+        if self.prefilter is not None and not self.prefilter.search(description):
+            return
+        # Query trigrams never span two words, so in this text they are found
+        # exactly where trigrams() would have produced them
+        text = "  " + _NON_WORD.sub("   ", description) + " "
+        shared = sum(gram in text for gram in self.grams)
+        if shared < self.minimum:
+            return
+        # Larger is better: more shared trigrams, then shorter, then older
+        size = len(trigrams(task["description"]))
+        match = (shared / len(self.grams), -size, -task["id"], task)
+        if self.limit is None:
+            self.matches.append(match)
+        elif len(self.matches) < self.limit:
+            heapq.heappush(self.matches, match)
+        elif self.matches and match[:3] > self.matches[0][:3]:
+            heapq.heapreplace(self.matches, match)
+    
+    def results(self) -> list[dict[str, Any]]:
+        """Return the matching tasks, best first."""
+        return [match[3] for match in sorted(self.matches, key=lambda match: match[:3], reverse=True)]
+
+
+class NextTaskIndex:
+    """A heap of open tasks ordered by priority, then id.
+    
+    Completed and deleted tasks are dropped from the live set straight away
+    but left in the heap until they surface, and the heap is rebuilt once
+    more than half of it is stale, so updates cost O(log n) amortized.
+    """
+    
+    # Completed tasks leave the heap.
+    tracks_status = True
+    
+    def __init__(self, tasks: Iterable[dict[str, Any]]):
+        self.live: dict[int, int] = {}
+        for task in tasks:
+            if not task["completed"]:
+                self.live[task["id"]] = self._rank(task)
+        self.heap = [(rank, task_id) for task_id, rank in self.live.items()]
+        heapq.heapify(self.heap)
+    
+    def add(self, task: dict[str, Any]):
+        if not task["completed"]:
+            rank = self._rank(task)
+            self.live[task["id"]] = rank
+            heapq.heappush(self.heap, (rank, task["id"]))
+    
+    def remove(self, task: dict[str, Any]):
+        self.live.pop(task["id"], None)
+        if len(self.heap) > 2 * len(self.live) + 64:
+            self.heap = [(rank, task_id) for task_id, rank in self.live.items()]
+            heapq.heapify(self.heap)
+    
+    def top(self, k: int) -> list[int]:
+        """Return the ids of the k most urgent open tasks."""
+        found: list[tuple[int, int]] = []
+        while self.heap and len(found) < k:
+            rank, task_id = heapq.heappop(self.heap)
+            if self.live.get(task_id) == rank:
+                found.append((rank, task_id))
+        # Put back what we took; stale entries stay popped
+        for entry in found:
+            heapq.heappush(self.heap, entry)
+        return [task_id for _, task_id in found]
+    
+    @staticmethod
+    def _rank(task: dict[str, Any]) -> int:
+        return _PRIORITY_RANK.get(task["priority"], len(PRIORITIES))
+
+
+class NextTaskScan:
+    """Picks the most urgent open tasks as they stream past, without an index.
+    
+    Gives the same results as NextTaskIndex.top for tasks that are read for
+    the occasion, holding only the best k so far in a heap whose top is the
+    least urgent of them.
+    """
+    
+    def __init__(self, k: int):
+        self.k = k
+        self.best: list[tuple[int, int, dict[str, Any]]] = []
+    
+    def add(self, task: dict[str, Any]):
+        if task["completed"] or self.k < 1:
+            return
+        # Larger is more urgent: higher priority, then older
+        entry = (-NextTaskIndex._rank(task), -task["id"], task)
+        if len(self.best) < self.k:
+            heapq.heappush(self.best, entry)
+        elif entry[:2] > self.best[0][:2]:
+            heapq.heapreplace(self.best, entry)
+    
+    def results(self) -> list[dict[str, Any]]:
+        """Return the tasks, most urgent first."""
+        return [entry[2] for entry in sorted(self.best, key=lambda entry: entry[:2], reverse=True)]
+
+
+def encode_cursor(task_id: int) -> str:
+    """Turn the last id of a page into an opaque cursor for the next one."""
+    return base64.urlsafe_b64encode(json.dumps({"after": task_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> int:
+    """Return the id a cursor continues after; None starts from the beginning."""
+    if cursor is None:
+        return 0
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["after"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+    if not isinstance(after, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return after
+
+
+def count_stats(counts: Iterable[tuple[str, bool, int]]) -> dict[str, Any]:
+    """Summarize (priority, completed, count) rows as a stats dict.
+    
+    Rows for the same group are added together, so per-shard counts can be
+    passed in one go.
+    """
+    stats: dict[str, Any] = {"total": 0, "open": 0, "completed": 0, "by_priority": {}}
+    for priority, completed, count in counts:
+        if not count:
+            continue
+        status = "completed" if completed else "open"
+        group = stats["by_priority"].setdefault(priority, {"open": 0, "completed": 0})
+        group[status] += count
+        stats[status] += count
+        stats["total"] += count
+    return stats
+
+
+def stats_counts(stats: dict[str, Any]) -> list[tuple[str, bool, int]]:
+    """Turn a stats dict back into (priority, completed, count) rows."""
+    return [
+        (priority, completed, group["completed" if completed else "open"])
+        for priority, group in stats["by_priority"].items()
+        for completed in (False, True)
+    ]
+
+
+class TaskTable:
+    """A task list indexed by id.
+    
+    Tasks live in a dict keyed by id, which keeps the order they were added
+    in, so finding, completing and deleting a task take constant time while
+    iterating still yields the list that gets written back to storage.
+    
+    Secondary indexes are built the first time a query needs them and then
+    kept up to date by add, complete and remove, so a table that is only
+    loaded, changed and saved never pays for them.
+    
+    next_id is where new ids start when it is past every task, as stored
+    alongside the tasks so ids of deleted tasks are not handed out again.
+    
+    Older versions could hand out an id again after a delete. A task whose
+    id is already taken is kept in duplicates, counted and saved back as it
+    was, but lookups and indexes only see the first task with that id until
+    renumber_duplicates() gives it a fresh one.
+    """
+    
+    def __init__(self, tasks: Iterable[dict[str, Any]] = (), next_id: int = 1):
+        self._tasks: dict[int, dict[str, Any]] = {}
+        self._next_id = next_id
+        self._indexes: dict[type, Any] = {}
+        self._counts: Counter[tuple[str, bool]] = Counter()
+        self.duplicates: list[dict[str, Any]] = []
+        for task in tasks:
+            self.add(task)
+    
+    def __len__(self) -> int:
+        return len(self._tasks) + len(self.duplicates)
+    
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return chain(self._tasks.values(), self.duplicates)
+    
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._tasks
+    
+    def get(self, task_id: int) -> dict[str, Any] | None:
+        """Return the task with task_id, or None."""
+        return self._tasks.get(task_id)
+    
+    def next_id(self) -> int:
+        """Return an id no task in the table, or deleted from it, has used."""
+        return self._next_id
+    
+    def add(self, task: dict[str, Any]) -> dict[str, Any]:
+        """Add a task and return it."""
+        self._next_id = max(self._next_id, task["id"] + 1)
+        self._counts[task["priority"], task["completed"]] += 1
+        if task["id"] in self._tasks:
+            self.duplicates.append(task)
+            return task
+        self._tasks[task["id"]] = task
+        for index in self._indexes.values():
+            index.add(task)
+        return task
+    
+    def renumber_duplicates(self, first_id: int | None = None) -> list[dict[str, Any]]:
+        """Give each duplicate a fresh id, in place, and return them.
+        
+        Ids run from first_id, or from next_id() when it isn't given.
+        """
+        moved, self.duplicates = self.duplicates, []
+        if first_id is None:
+            first_id = self._next_id
+        for offset, task in enumerate(moved):
+            self._counts[task["priority"], task["completed"]] -= 1
+            task["id"] = first_id + offset
+            self.add(task)
+        return moved
+    
+    def complete(self, task_id: int) -> dict[str, Any] | None:
+        """Mark a task complete and return it, or None if there is no such task."""
+        task = self._tasks.get(task_id)
+        if task is not None and not task["completed"]:
+            # The text and trigram indexes don't change, so a completion
+            # costs nothing more for having searched.
+            touched = [index for index in self._indexes.values() if index.tracks_status]
+            for index in touched:
+                index.remove(task)
+            task["completed"] = True
+            self._counts[task["priority"], False] -= 1
+            self._counts[task["priority"], True] += 1
+            for index in touched:
+                index.add(task)
+        return task
+    
+    def remove(self, task_id: int) -> dict[str, Any] | None:
+        """Delete a task and return it, or None if there is no such task."""
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            self._counts[task["priority"], task["completed"]] -= 1
+            for index in self._indexes.values():
+                index.remove(task)
+        return task
+    
+    def stats(self) -> dict[str, Any]:
+        """Count tasks by status and priority without looking at any task."""
+        return count_stats(
+            (priority, completed, count) for (priority, completed), count in self._counts.items()
+        )
+    
+    def select(self, priority: str | None = None, completed: bool | None = None) -> Iterator[dict[str, Any]]:
+        """Yield the tasks with the given priority and/or completion status.
+        
+        Goes through a StatusIndex, so the cost follows the number of
+        matches rather than the size of the table.
+        """
+        if priority is None and completed is None:
+            yield from self
+            return
+        for task_id in self.index(StatusIndex).ids(priority, completed):
+            yield self._tasks[task_id]
+    
+    def page(
+        self,
+        after: int = 0,
+        limit: int = 20,
+        priority: str | None = None,
+        completed: bool | None = None
+    ) -> list[dict[str, Any]]:
+        """Return up to limit matching tasks with ids greater than after, by id.
+        
+        Starts with a binary search in the StatusIndex, so a page costs about
+        limit steps wherever it is in the table.
+        """
+        ids = self.index(StatusIndex).ids(priority, completed, after)
+        return [self._tasks[task_id] for task_id in islice(ids, limit)]
+    
+    def search(self, query: str, limit: int | None = None) -> list[dict[str, Any]]:
+        """Return the tasks whose descriptions match query, best match first.
+        
+        See parse_query for the syntax. Goes through a TextIndex, so only
+        tasks containing the query words are looked at.
+        """
+        ranked = self.index(TextIndex).search(query, limit)
+        return [self._tasks[task_id] for task_id, _ in ranked]
+    
+    def fuzzy_search(self, query: str, limit: int | None = None, threshold: float = 0.5) -> list[dict[str, Any]]:
+        """Return the tasks whose descriptions roughly contain query, best first.
+        
+        Goes through a TrigramIndex, so misspellings and partial words match
+        and only tasks sharing the query's rarer trigrams are looked at.
+        """
+        ranked = self.index(TrigramIndex).search(query, limit, threshold)
+        return [self._tasks[task_id] for task_id, _ in ranked]
+    
+    def next_tasks(self, k: int) -> list[dict[str, Any]]:
+        """Return the k most urgent open tasks: by priority, then oldest first."""
+        return [self._tasks[task_id] for task_id in self.index(NextTaskIndex).top(k)]
+    
+    def index(self, kind: type) -> Any:
+        """Return the secondary index of the given class, building it on first use."""
+        if kind not in self._indexes:
+            self._indexes[kind] = kind(self._tasks.values())
+        return self._indexes[kind]
+
+
+def document_meta(tasks: TaskTable) -> dict[str, Any]:
+    """Return the metadata stored alongside a task table."""
+    return {"next_id": tasks.next_id(), "stats": tasks.stats()}
+
+
+def encode_document(tasks: TaskTable, format: str = "array", metadata: bool = False) -> str:
+    """Render a task table as file text, ending in its metadata trailer if asked."""
+    body = encode_tasks(tasks, format)
+    if not metadata:
+        return body
+    if body and not body.endswith("\n"):
+        body += "\n"
+    return body + META_PREFIX + json.dumps(document_meta(tasks)) + "\n"
+
+
+def record_task_id(record: dict[str, Any]) -> int:
+    """Return the id of the task a mutation record touches."""
+    return record["task"]["id"] if record["op"] == "add" else record["id"]
+
+
+def apply_record(tasks: TaskTable, record: dict[str, Any]) -> dict[str, Any] | None:
+    """Apply one mutation record to tasks in place and return the affected task."""
+    if record["op"] == "add":
+        return tasks.add(record["task"])
+    if record["op"] == "complete":
+        return tasks.complete(record["id"])
+    if record["op"] == "delete":
+        return tasks.remove(record["id"])
+    return None
+
+
+class Transaction:
+    """Changes staged against one read of the task list.
+    
+    Each change is applied to a private copy straight away, so later steps
+    see earlier ones, and kept as a record for the single write at commit.
+    """
+    
+    def __init__(self, tasks: TaskTable):
+        self.tasks = TaskTable((dict(task) for task in tasks), tasks.next_id())
+        self.records: list[dict[str, Any]] = []
+        self.added: list[dict[str, Any]] = []
+    
+    def add(self, description: str, priority: str = "medium") -> dict[str, Any]:
+        """Stage a new task and return it.
+        
+        The task gets the next id of this copy. Storages that reserve ids
+        elsewhere have renumber move it to a reserved one before saving.
+        """
+        record = {"op": "add", "task": {
+            "id": self.tasks.next_id(),
+            "description": description,
+            "priority": priority,
+            "completed": False
+        }}
+        self._apply(record)
+        self.added.append(record["task"])
+        return record["task"]
+    
+    def renumber(self, first_id: int):
+        """Give the added tasks consecutive ids from first_id, in place."""
+        ids = {}
+        for offset, task in enumerate(self.added):
+            ids[task["id"]] = first_id + offset
+            task["id"] = first_id + offset
+        for record in self.records:
+            if record["op"] != "add":
+                record["id"] = ids.get(record["id"], record["id"])
+        self.tasks = TaskTable(self.tasks, self.tasks.next_id())
+    
+    def complete(self, task_id: int) -> bool:
+        """Stage marking a task complete, returning whether it exists."""
+        return self._apply({"op": "complete", "id": task_id})
+    
+    def delete(self, task_id: int) -> bool:
+        """Stage deleting a task, returning whether it exists."""
+        return self._apply({"op": "delete", "id": task_id})
+    
+    def _apply(self, record: dict[str, Any]) -> bool:
+        """Apply record to the copy and keep it if it touched a task."""
+        if apply_record(self.tasks, record) is None:
+            return False
+        self.records.append(record)
+        return True
+
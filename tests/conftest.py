@@ -0,0 +1,109 @@
+"""Shared fixtures: an in-memory stand-in for the filesystem MCP server."""
+
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mcp_task_manager  # noqa: E402
+
+
+class FakeSession:
+    """Answers the filesystem tools TaskManager uses from a dict of files.
+
+    Sessions built over the same files and mtimes dicts behave like two
+    clients of one server. Every tool call is recorded in calls.
+    """
+
+    def __init__(self, files: dict[str, str] | None = None, mtimes: dict[str, int] | None = None):
+        self.files = files if files is not None else {}
+        self.mtimes = mtimes if mtimes is not None else {}
+        self.calls: list[str] = []
+
+    @staticmethod
+    def _result(text: str, error: bool = False):
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], isError=error)
+
+    def _write(self, path: str, content: str):
+        self.files[path] = content
+        self.mtimes[path] = time.time_ns()
+
+    async def close(self):
+        pass
+
+    async def call_tool(self, name: str, arguments: dict | None = None):
+        args = arguments or {}
+        self.calls.append(name)
+        path = args.get("path")
+        if name == "read_file":
+            if path not in self.files:
+                return self._result(f"Error: ENOENT {path}", error=True)
+            lines = self.files[path].split("\n")
+            if args.get("tail"):
+                end = len(lines) - 1 if self.files[path].endswith("\n") else len(lines)
+                lines = lines[max(end - args["tail"], 0):]
+            elif args.get("head"):
+                lines = lines[:args["head"]]
+            return self._result("\n".join(lines))
+        if name == "write_file":
+            self._write(path, args["content"])
+            return self._result(f"Successfully wrote to {path}")
+        if name == "edit_file":
+            if path not in self.files:
+                return self._result(f"Error: ENOENT {path}", error=True)
+            content = self.files[path]
+            for edit in args["edits"]:
+                if edit["oldText"] not in content:
+                    return self._result(f"Error: Could not find exact match for edit:\n{edit['oldText']}", error=True)
+                content = content.replace(edit["oldText"], edit["newText"], 1)
+            self._write(path, content)
+            return self._result("```diff\n```")
+        if name == "get_file_info":
+            if path not in self.files:
+                return self._result(f"Error: ENOENT {path}", error=True)
+            size = len(self.files[path].encode())
+            return self._result(f"size: {size}\nmodified: {self.mtimes[path]}\nisFile: true")
+        if name == "read_multiple_files":
+            parts = [
+                f"{p}:\n{self.files[p]}\n" if p in self.files else f"{p}: Error - ENOENT"
+                for p in args["paths"]
+            ]
+            return self._result("\n---\n".join(parts))
+        if name == "list_directory":
+            prefix = path.rstrip("/") + "/"
+            return self._result("\n".join(f"[FILE] {p[len(prefix):]}" for p in self.files if p.startswith(prefix)))
+        return self._result(f"Error: unknown tool {name}", error=True)
+
+
+@pytest.fixture
+def files() -> dict[str, str]:
+    """The fake server's files, by path."""
+    return {}
+
+
+@pytest.fixture
+def make_manager(files, monkeypatch):
+    """Build TaskManagers connected to the fake server.
+
+    Files written a moment ago count as settled, so cache_reads caches
+    straight away instead of waiting out RACY_WINDOW.
+    """
+    monkeypatch.setattr(mcp_task_manager, "RACY_WINDOW", -1)
+    mtimes: dict[str, int] = {}
+
+    def make(**options) -> mcp_task_manager.TaskManager:
+        manager = mcp_task_manager.TaskManager(tool_cache=None, **options)
+        manager.session = FakeSession(files, mtimes)
+        return manager
+
+    return make
+
+
+def task_lines(content: str) -> list[dict]:
+    """Parse the JSON lines of a file, skipping "#" header and trailer lines."""
+    return [json.loads(line) for line in content.splitlines() if line and not line.startswith("#")]
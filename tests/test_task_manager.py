@@ -0,0 +1,250 @@
+"""Tests for TaskManager's group commit, its failure paths, and log replay."""
+
+import asyncio
+
+import pytest
+
+from mcp_task_manager import LockLost, VersionConflict
+
+
+async def all_tasks(manager) -> list[dict]:
+    return [task async for task in manager.iter_tasks()]
+
+
+def test_concurrent_adds_share_one_read_and_one_write(make_manager):
+    async def scenario():
+        manager = make_manager()
+        await manager.add_task("seed")
+        manager.session.calls.clear()
+        await asyncio.gather(*(manager.add_task(f"task {i}") for i in range(20)))
+        assert manager.session.calls == ["read_file", "write_file"]
+        tasks = await all_tasks(manager)
+        assert [task["id"] for task in tasks] == list(range(1, 22))
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_changes_to_the_log_ship_in_one_append(make_manager):
+    async def scenario():
+        manager = make_manager(storage="log")
+        await manager.add_tasks(["a", "b", "c"])
+        manager.session.calls.clear()
+        await asyncio.gather(
+            manager.add_task("d"),
+            manager.complete_task(1),
+            manager.delete_task(2),
+            manager.complete_task(99),
+        )
+        assert manager.session.calls == ["edit_file"]
+        tasks = {task["id"]: task for task in await all_tasks(manager)}
+        assert sorted(tasks) == [1, 3, 4]
+        assert tasks[1]["completed"]
+
+    asyncio.run(scenario())
+
+
+def test_commit_window_batches_changes_queued_one_after_another(make_manager):
+    async def scenario():
+        manager = make_manager(commit_window=0.05)
+        await manager.add_task("seed")
+        manager.session.calls.clear()
+        first = asyncio.create_task(manager.add_task("a"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(manager.add_task("b"))
+        await asyncio.gather(first, second)
+        assert manager.session.calls.count("write_file") == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("options", [{}, {"cache_reads": True}, {"storage": "log"}])
+def test_failing_change_fails_only_its_caller(make_manager, options):
+    def half_done(tasks):
+        tasks.add({"id": 100, "description": "half done", "priority": "low", "completed": False})
+        raise ValueError("broken change")
+
+    async def scenario():
+        manager = make_manager(**options)
+        await manager.add_task("seed")
+        results = await asyncio.gather(
+            manager.add_task("kept"),
+            manager._mutate(half_done),
+            manager.complete_task(1),
+            return_exceptions=True,
+        )
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], ValueError)
+        tasks = await all_tasks(manager)
+        assert [task["description"] for task in tasks] == ["seed", "kept"]
+        assert tasks[0]["completed"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("options", [{}, {"cache_reads": True}, {"storage": "sharded"}])
+def test_write_error_fails_every_caller_in_the_batch(make_manager, options):
+    async def scenario():
+        manager = make_manager(**options)
+        await manager.add_tasks(["a", "b"])
+        session = manager.session
+        serve = session.call_tool
+
+        async def unreachable(name, arguments=None):
+            if name in ("write_file", "edit_file"):
+                raise ConnectionError("server went away")
+            return await serve(name, arguments)
+
+        session.call_tool = unreachable
+        results = await asyncio.gather(
+            manager.add_task("c"),
+            manager.complete_task(1),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+        session.call_tool = serve
+        tasks = await all_tasks(manager)
+        assert [task["description"] for task in tasks] == ["a", "b"]
+        assert not tasks[0]["completed"]
+
+    asyncio.run(scenario())
+
+
+def test_failed_log_append_is_not_replayed(make_manager, files):
+    async def scenario():
+        manager = make_manager(storage="log")
+        await manager.add_tasks(["a", "b"])
+        serve = manager.session.call_tool
+
+        async def unreachable(name, arguments=None):
+            if name == "edit_file":
+                raise ConnectionError("server went away")
+            return await serve(name, arguments)
+
+        manager.session.call_tool = unreachable
+        with pytest.raises(ConnectionError):
+            await manager.complete_task(1)
+        manager.session.call_tool = serve
+
+        assert not (await all_tasks(manager))[0]["completed"]
+        await manager.add_task("c")
+        stats = await manager.storage.stats()
+        assert (stats["total"], stats["completed"]) == (3, 0)
+        reread = make_manager(storage="log")
+        assert [task["completed"] for task in await all_tasks(reread)] == [False] * 3
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("options", [{"cache_reads": True}, {"storage": "log"}])
+def test_lost_lease_leaves_no_change_behind(make_manager, options):
+    def lease_gone():
+        raise LockLost("lease expired")
+
+    async def scenario():
+        manager = make_manager(lock=True, **options)
+        await manager.lock.create()
+        await manager.add_tasks(["a", "b"])
+        await manager.list_tasks()
+        manager.lock.check = lease_gone
+        with pytest.raises(LockLost):
+            await manager.complete_task(1)
+        assert not (await manager.storage.load()).get(1)["completed"]
+
+    asyncio.run(scenario())
+
+
+def test_write_back_keeps_changes_whose_flush_failed(make_manager, files):
+    async def scenario():
+        manager = make_manager(write_back=True, flush_interval=60)
+        await manager.add_tasks(["a", "b"])
+        serve = manager.session.call_tool
+
+        async def unreachable(name, arguments=None):
+            raise ConnectionError("server went away")
+
+        manager.session.call_tool = unreachable
+        with pytest.raises(ConnectionError):
+            await manager.flush()
+        manager.session.call_tool = serve
+        await manager.flush()
+
+        reread = make_manager()
+        assert [task["description"] for task in await all_tasks(reread)] == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_write_back_rejects_versioned(make_manager):
+    with pytest.raises(ValueError):
+        make_manager(write_back=True, versioned=True)
+
+
+@pytest.mark.parametrize("options", [{}, {"cache_reads": True}, {"format": "ndjson"}])
+def test_versioned_writers_retry_instead_of_losing_updates(make_manager, options):
+    async def scenario():
+        first = make_manager(versioned=True, retry_delay=0.001, **options)
+        second = make_manager(versioned=True, retry_delay=0.001, **options)
+        await asyncio.gather(*(
+            manager.add_task(f"{name} {i}")
+            for i in range(15)
+            for name, manager in (("first", first), ("second", second))
+        ))
+        await asyncio.gather(first.complete_task(2), second.complete_task(3), first.delete_task(1))
+
+        tasks = await all_tasks(make_manager())
+        assert len(tasks) == 29
+        assert len({task["id"] for task in tasks}) == 29
+        assert len({task["description"] for task in tasks}) == 29
+        assert [task["id"] for task in tasks if task["completed"]] == [2, 3]
+
+    asyncio.run(scenario())
+
+
+def test_versioned_conflict_reaches_the_caller_once_retries_run_out(make_manager):
+    async def scenario():
+        manager = make_manager(versioned=True, max_retries=2, retry_delay=0.001)
+        other = make_manager(versioned=True)
+        await manager.add_task("a")
+        load = manager.storage.load_for_update
+
+        async def load_then_lose_race(task_ids=None):
+            tasks = await load(task_ids)
+            await other.add_task("sneaked in")
+            return tasks
+
+        manager.storage.load_for_update = load_then_lose_race
+        with pytest.raises(VersionConflict):
+            await manager.complete_task(1)
+        tasks = await all_tasks(make_manager())
+        assert [task["description"] for task in tasks] == ["a"] + ["sneaked in"] * 3
+        assert not tasks[0]["completed"]
+
+    asyncio.run(scenario())
+
+
+def test_log_replays_the_same_tasks_after_compaction(make_manager, files):
+    async def scenario():
+        manager = make_manager(storage="log", compact_min_records=1)
+        await manager.add_tasks([f"task {i}" for i in range(10)])
+        await manager.complete_task(2)
+        await manager.delete_task(3)
+        before = await all_tasks(manager)
+
+        assert manager.storage.needs_compaction()
+        await manager.storage.compact()
+        assert not manager.storage.needs_compaction()
+        assert len(files["/tmp/tasks.log"].splitlines()) < 12
+
+        await manager.add_task("after compaction")
+        await manager.complete_task(4)
+        expected = await all_tasks(manager)
+        assert expected[:2] == before[:2]
+
+        reread = make_manager(storage="log")
+        assert await all_tasks(reread) == expected
+        assert await reread.stats() == await manager.stats()
+        await reread.add_task("next")
+        assert (await all_tasks(reread))[-1]["id"] == 12
+
+    asyncio.run(scenario())